@@ -0,0 +1,93 @@
+import os
+import io
+import tempfile
+import warnings
+
+from time import perf_counter
+from contextlib import redirect_stdout
+from argparse import ArgumentParser
+
+import numpy as np
+import xarray as xr
+
+from processing import encoding
+from processing.fwi import FusedComputation
+from processing.dataset import Dataset
+from benchmarks.synthetic import get_grid, get_weather, get_regions
+
+
+def get_combined(step=.25, days=92, seed=0):
+    """Combined-like dataset: FWI of synthetic weather, forest share and fire counts, clipped to synthetic regions"""
+
+    rng = np.random.default_rng(seed)
+    grid = get_grid(step=step, days=days)
+
+    with tempfile.TemporaryDirectory() as folder:
+        get_weather(grid, seed).to_netcdf(f'{folder}/weather.nc')
+
+        with redirect_stdout(io.StringIO()):
+            fwi = FusedComputation(f'{folder}/weather.nc', None).get_fwi_ds().FWI.load()
+
+        ds = xr.Dataset({'FWI': fwi,
+                         'forest_cover': (['y', 'x'], rng.beta(.5, .8, grid.shape[1:])),
+                         'counts': (['time', 'y', 'x'], rng.poisson(.02, grid.shape).astype(float))})
+
+        dataset = Dataset(geo=get_regions())
+        dataset.root = folder
+
+        return dataset.clip(ds)
+
+
+def read(path, repeat=3):
+    seconds = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+        with xr.open_dataset(path) as ds:
+            ds.load()
+        seconds.append(perf_counter() - start)
+
+    return min(seconds)
+
+
+parser = ArgumentParser(description='Compare the size and read time of the float and compact encodings')
+parser.add_argument('--source', help="combined '{year}.nc' file, synthetic data by default")
+parser.add_argument('--step', type=float, default=.25)
+parser.add_argument('--days', type=int, default=92)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore', category=RuntimeWarning)
+
+    if args.source:
+        ds = xr.open_dataset(args.source).load()
+    else:
+        ds = get_combined(args.step, args.days)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {'float': f'{folder}/float.nc', 'compact': f'{folder}/compact.nc'}
+
+        # the float file as the pipeline writes it by default, without the encoding of the source
+        ds.drop_encoding().to_netcdf(paths['float'], unlimited_dims=['time'])
+        encoding.to_netcdf(ds, paths['compact'], compact=True, unlimited_dims=['time'])
+
+        sizes = {name: os.path.getsize(path) / 2**20 for name, path in paths.items()}
+        seconds = {name: read(path) for name, path in paths.items()}
+
+        print('{:<10}{:>12}{:>12}'.format('', 'size, MB', 'read, s'))
+        for name in paths:
+            print('{:<10}{:>12.1f}{:>12.3f}'.format(name, sizes[name], seconds[name]))
+        print('{:<10}{:>11.1f}x{:>11.1f}x'.format('savings', sizes['float'] / sizes['compact'],
+                                                  seconds['float'] / seconds['compact']))
+
+        # the reads above are served from the page cache, from a slower disk the float file also waits for
+        # the extra bytes, so the compact one is faster below this bandwidth
+        if seconds['compact'] > seconds['float']:
+            print('compact reads are faster below {:.0f} MB/s'.format(
+                (sizes['float'] - sizes['compact']) / (seconds['compact'] - seconds['float'])))
+
+        with xr.open_dataset(paths['compact']) as compact:
+            for var in ds.data_vars:
+                error = np.nanmax(np.abs(compact[var].to_numpy() - ds[var].to_numpy()))
+                same_nan = (np.isnan(compact[var].to_numpy()) == np.isnan(ds[var].to_numpy())).all()
+                print(f'{var}: max abs error {error:.4g}, same missing pixels: {same_nan}')
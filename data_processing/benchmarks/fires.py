@@ -0,0 +1,39 @@
+from time import time
+from argparse import ArgumentParser
+
+from processing.fires import Fires
+from benchmarks.synthetic import get_grid, get_points
+
+
+def run(method, data, grid):
+    start = time()
+    counts = method(data, grid)
+    elapsed = time() - start
+
+    return counts, elapsed
+
+
+parser = ArgumentParser()
+parser.add_argument('-n', '--points', type=int, default=1_000_000)
+parser.add_argument('--reference', type=int, default=2_000)
+parser.add_argument('--step', type=float, default=.25)
+
+args = parser.parse_args()
+
+fires = Fires(2021)
+grid = get_grid(step=args.step)
+
+points = get_points(grid, args.points)
+reference = points.iloc[:args.reference]
+
+counts, elapsed = run(fires.get_counts, points, grid)
+print('get_counts: {:,} points in {:.2f} s ({:,.0f} points/s)'.format(
+    len(points), elapsed, len(points) / elapsed))
+
+counts_new, elapsed_new = run(fires.get_counts, reference, grid)
+counts_cx, elapsed_cx = run(fires.get_counts_cx, reference, grid)
+print('get_counts_cx: {:,} points in {:.2f} s ({:,.0f} points/s)'.format(
+    len(reference), elapsed_cx, len(reference) / elapsed_cx))
+
+print('Speedup on {:,} points: {:.0f}x, identical counts: {}'.format(
+    len(reference), elapsed_cx / elapsed_new, counts_new.identical(counts_cx)))
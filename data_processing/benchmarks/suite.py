@@ -0,0 +1,272 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import warnings
+import tracemalloc
+import subprocess
+
+from time import perf_counter
+from datetime import datetime
+from contextlib import redirect_stdout
+from argparse import ArgumentParser
+
+import pandas as pd
+
+from utils import CustomCRS
+from processing.fwi import CodesComputation, IndexComputation, FusedComputation
+from processing.fires import Fires
+from processing.forest import Forest
+from processing.weather import DataLoader
+from processing.dataset import Dataset
+from benchmarks.synthetic import get_grid, get_points, get_weather, get_land, get_regions, write_tiles
+
+
+SIZES = {'small': {'step': .5, 'days': 16, 'points': 200_000, 'land_step': 1 / 60, 'tiles': 4},
+         'medium': {'step': .25, 'days': 64, 'points': 1_000_000, 'land_step': 1 / 120, 'tiles': 8},
+         'large': {'step': .1, 'days': 184, 'points': 5_000_000, 'land_step': 1 / 360, 'tiles': 32}}
+
+
+class Suite:
+    """Every stage of the pipeline on synthetic inputs of a given size.
+
+    A 'bench_{name}' method prepares the inputs of one stage in 'folder' and returns the function to time,
+    the amount of work it does and the unit of that work, so the throughput is comparable between sizes"""
+
+    def __init__(self, folder, step=.5, days=16, points=200_000, land_step=1 / 60, tiles=4):
+        self.folder = folder
+        self.step = step
+        self.days = days
+        self.points = points
+        self.land_step = land_step
+        self.tiles = tiles
+
+        self.crs = CustomCRS().get_crs()
+        self.grid = get_grid(step=step, days=days)
+        self.cells = self.grid.shape[1] * self.grid.shape[2]
+
+    @classmethod
+    def get_names(cls):
+        return [name[len('bench_'):] for name in dir(cls) if name.startswith('bench_')]
+
+    def get_weather_path(self, name='weather', y=None, x=None):
+        path = f'{self.folder}/{name}.nc'
+
+        if not os.path.exists(path):
+            get_weather(self.grid).isel(y=slice(y), x=slice(x)).to_netcdf(path)
+
+        return path
+
+    def get_codes_path(self):
+        path = f'{self.folder}/codes.nc'
+
+        if not os.path.exists(path):
+            CodesComputation(self.get_weather_path(), path).get_codes_ds()
+
+        return path
+
+    def get_tiles(self):
+        folder = f'{self.folder}/tiles'
+
+        if not os.path.exists(folder):
+            write_tiles(folder, days=self.tiles, step=self.step)
+
+        return f'{folder}/east', f'{folder}/west'
+
+    def get_loader(self):
+        loader = DataLoader(2021, cleanup=False)
+        loader.root = self.folder
+
+        return loader
+
+    def bench_codes_vector(self):
+        path = self.get_weather_path()
+
+        return lambda: CodesComputation(path, None, engine='vector').get_codes_ds(), \
+            self.cells * self.days, 'cell-days'
+
+    def bench_codes_numba(self):
+        path = self.get_weather_path()
+        # compile the kernels outside of the timed run
+        CodesComputation(self.get_weather_path('weather_scalar', 2, 2), None, engine='numba').get_codes_ds()
+
+        return lambda: CodesComputation(path, None, engine='numba').get_codes_ds(), \
+            self.cells * self.days, 'cell-days'
+
+    def bench_codes_scalar(self):
+        # the scalar engine loops over pixels in Python, a corner of the grid is enough
+        path = self.get_weather_path('weather_scalar', 16, 16)
+
+        return lambda: CodesComputation(path, None, engine='scalar').get_codes_ds(), 16 * 16 * self.days, 'cell-days'
+
+    def bench_fused(self):
+        """The default engine, codes and index of every day in one pass, comparable to 'codes_*' plus 'index'"""
+
+        path = self.get_weather_path()
+
+        return lambda: FusedComputation(path, None).get_fwi_ds(), self.cells * self.days, 'cell-days'
+
+    def bench_index(self):
+        path = self.get_codes_path()
+
+        return lambda: IndexComputation(path, None).get_fwi_ds(), self.cells * self.days, 'cell-days'
+
+    def bench_fires(self):
+        fires = Fires(2021)
+        points = get_points(self.grid, self.points)
+
+        return lambda: fires.get_counts(points, self.grid), self.points, 'points'
+
+    def bench_forest_flags(self):
+        da = get_land(step=self.land_step)
+
+        return lambda: Forest.get_forest_flags(da.copy()), da.size, 'pixels'
+
+    def bench_forest_blocks(self):
+        da = get_land(step=self.land_step)
+        match_da = self.grid.isel(time=0).rio.write_crs(self.crs)
+        forest = Forest(2021)
+
+        return lambda: forest.aggregate_forest(da, match_da), da.size, 'pixels'
+
+    def bench_merge_gdal(self):
+        path_east, path_west = self.get_tiles()
+
+        return lambda: DataLoader.merge_weather(path_east, path_west, self.crs, cleanup=False), \
+            self.tiles, 'days'
+
+    def bench_merge_cached(self):
+        """Cold run, the reprojection indexes are computed and saved every time"""
+
+        path_east, path_west = self.get_tiles()
+        loader = self.get_loader()
+
+        def run():
+            DataLoader.indexes.clear()
+            shutil.rmtree(f'{loader.root}/data', ignore_errors=True)
+            loader.merge_weather_cached(path_east, path_west, self.crs)
+
+        return run, self.tiles, 'days'
+
+    def bench_merge_cached_warm(self):
+        path_east, path_west = self.get_tiles()
+        loader = self.get_loader()
+        loader.merge_weather_cached(path_east, path_west, self.crs)
+
+        return lambda: loader.merge_weather_cached(path_east, path_west, self.crs), self.tiles, 'days'
+
+    def bench_clip(self):
+        dataset = Dataset(region='rus', geo=get_regions())
+        # keep the cached masks in the temporary folder
+        dataset.root = self.folder
+        ds = get_weather(self.grid)[['Wind_Speed_10m_Mean']]
+        # the mask is rasterized once per grid, the timed run clips with the cached one
+        dataset.get_mask(ds)
+
+        return lambda: dataset.clip(ds), self.cells * self.days, 'cell-days'
+
+
+def measure(func, repeat=1):
+    """Best wall time of 'repeat' runs and the peak of Python and numpy allocations of one more run, memory
+    allocated by GDAL or netCDF is not traced"""
+
+    seconds = []
+
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            seconds.append(perf_counter() - start)
+
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return min(seconds), peak / 2**20
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(names, size, repeat=1):
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        suite = Suite(folder, **size)
+
+        for name in names:
+            with redirect_stdout(io.StringIO()):
+                func, work, unit = getattr(suite, f'bench_{name}')()
+
+            seconds, peak = measure(func, repeat)
+
+            results[name] = {'seconds': seconds, 'throughput': work / seconds, 'unit': f'{unit}/s', 'peak_mb': peak}
+            print('{}: {:.3f} s, {:,.0f} {}/s, {:.1f} MB peak'.format(name, seconds, work / seconds, unit, peak))
+
+    return results
+
+
+def compare(results, path):
+    """Table of the current results against a saved run, ratios above 1 mean the current run is faster
+    or uses less memory"""
+
+    with open(path) as f:
+        previous = json.load(f)['results']
+
+    rows = []
+
+    for name, current in results.items():
+        if name not in previous:
+            continue
+
+        rows.append({'stage': name,
+                     'seconds': current['seconds'],
+                     'seconds_before': previous[name]['seconds'],
+                     'speedup': previous[name]['seconds'] / current['seconds'],
+                     'peak_mb': current['peak_mb'],
+                     'peak_mb_before': previous[name]['peak_mb'],
+                     'memory_ratio': previous[name]['peak_mb'] / max(current['peak_mb'], 1e-9)})
+
+    return pd.DataFrame(rows).set_index('stage')
+
+
+parser = ArgumentParser(description='Time every processing stage on synthetic data')
+parser.add_argument('--size', default='small', choices=list(SIZES))
+parser.add_argument('--step', type=float, help='grid step in degrees, overrides the size')
+parser.add_argument('--days', type=int, help='days of the grid, overrides the size')
+parser.add_argument('--points', type=int, help='fire detections, overrides the size')
+parser.add_argument('--only', nargs='+', choices=Suite.get_names(), help='stages to run, all by default')
+parser.add_argument('--repeat', type=int, default=1)
+parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results'),
+                    help="folder of the '{date}_{commit}.json' results")
+parser.add_argument('--compare', metavar='JSON', help='results of a previous run to compare with')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore', category=RuntimeWarning)
+    warnings.filterwarnings('ignore', category=FutureWarning)
+
+    size = dict(SIZES[args.size])
+    size.update({key: getattr(args, key) for key in ['step', 'days', 'points'] if getattr(args, key) is not None})
+
+    results = run(args.only or Suite.get_names(), size, args.repeat)
+
+    commit = get_commit()
+    os.makedirs(args.output, exist_ok=True)
+    path = f'{args.output}/{datetime.now():%Y%m%d-%H%M%S}_{commit}.json'
+
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'), 'size': size,
+                   'results': results}, f, indent=2)
+
+    print(f'Results saved to {path}')
+
+    if args.compare:
+        print(compare(results, args.compare).round(3))
@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import xarray as xr
+import pandas as pd
+import geopandas as gpd
+
+from shapely.geometry import box, Polygon
+
+
+def get_grid(year=2021, step=.1, days=None):
+    """Daily grid covering Russia in the shifted CRS, the same extent as the FWI output"""
+
+    time_coords = pd.date_range(f'{year}-01-01', f'{year}-12-31')[:days]
+    y_coords = np.round(np.arange(83, 43, -step), 2)
+    x_coords = np.round(np.arange(0, 174, step), 2)
+
+    return xr.DataArray(
+        data=np.broadcast_to(np.float32(0), (len(time_coords), len(y_coords), len(x_coords))),
+        dims=['time', 'y', 'x'],
+        coords={'time': time_coords, 'y': y_coords, 'x': x_coords})
+
+
+def get_points(grid, n, seed=0):
+    """VIIRS-like detections scattered over the grid extent, including points outside it"""
+
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({'longitude': rng.uniform(float(grid.x.min()) - 1, float(grid.x.max()) + 1, n),
+                       'latitude': rng.uniform(float(grid.y.min()) - 1, float(grid.y.max()) + 1, n),
+                       'acq_date': rng.choice(grid.time.values, n)})
+
+    return gpd.GeoDataFrame(data=df, geometry=gpd.points_from_xy(df.longitude, df.latitude))
+
+
+def get_weather(grid, seed=0):
+    """Weather cube on 'grid' with the variables and units 'get_code_arr' reads, ocean pixels are NaN"""
+
+    rng = np.random.default_rng(seed)
+    shape = grid.shape
+
+    season = np.sin(np.pi * (grid.time.dt.dayofyear.to_numpy() - 80) / 365)[:, np.newaxis, np.newaxis]
+    land = rng.random(shape[1:]) < .9
+
+    variables = {'Temperature_Air_2m_Mean_24h': 25 * season + rng.normal(0, 4, shape),
+                 'Relative_Humidity_min': np.clip(rng.normal(45, 15, shape), 5, 100),
+                 'Wind_Speed_10m_Mean': rng.gamma(2, 6, shape),
+                 'Precipitation_Flux': np.where(rng.random(shape) < .3, rng.gamma(1, 5, shape), 0)}
+
+    ds = xr.Dataset(coords=grid.coords)
+
+    for var, arr in variables.items():
+        ds[var] = (['time', 'y', 'x'], np.where(land, arr, np.nan).astype(np.float32))
+
+    ds['Month'] = (['time'], grid.time.dt.month.values)
+
+    return ds
+
+
+def get_land(step=1 / 360, extent=(18, 60, 40, 83), seed=0):
+    """ESA CCI-like 'lccs_class' raster in patches of classes, 'extent' is (lon_min, lon_max, lat_min, lat_max)"""
+
+    rng = np.random.default_rng(seed)
+    flag_values = np.array([0, 10, 11, 12, 20, 30, 40, 50, 60, 61, 62, 70, 71, 72, 80, 81, 82, 90, 100, 110, 120,
+                            121, 122, 130, 140, 150, 151, 152, 153, 160, 170, 180, 190, 200, 201, 202, 210, 220],
+                           dtype=np.uint8)
+
+    lon = np.arange(extent[0] + step / 2, extent[1], step)
+    lat = np.arange(extent[3] - step / 2, extent[2], -step)
+
+    patches = rng.integers(0, len(flag_values), (len(lat) // 32 + 1, len(lon) // 32 + 1))
+    classes = np.repeat(np.repeat(patches, 32, axis=0), 32, axis=1)[:len(lat), :len(lon)]
+
+    return xr.DataArray(flag_values[classes], name='lccs_class', dims=['lat', 'lon'],
+                        coords={'lat': lat, 'lon': lon}, attrs={'flag_values': flag_values})
+
+
+def get_regions(n=80, extent=(20, 180, 42, 82), vertices=64, seed=0):
+    """'regions.json'-like polygons with an 'ID_1' column, tiling 'extent' in EPSG:4326 with jagged borders"""
+
+    rng = np.random.default_rng(seed)
+
+    columns = int(np.ceil(np.sqrt(n * 2)))
+    rows = int(np.ceil(n / columns))
+    lon_edges = np.linspace(extent[0], extent[1], columns + 1)
+    lat_edges = np.linspace(extent[2], extent[3], rows + 1)
+
+    geometries = []
+
+    for i in range(n):
+        row, column = divmod(i, columns)
+        cell = box(lon_edges[column], lat_edges[row], lon_edges[column + 1], lat_edges[row + 1])
+
+        # densify the border and shake it a little, so the polygons are as costly as real borders
+        points = np.array([cell.exterior.interpolate(d, normalized=True).coords[0]
+                           for d in np.linspace(0, 1, vertices, endpoint=False)])
+        points += rng.normal(0, .02, points.shape)
+
+        geometries.append(Polygon(points).buffer(0))
+
+    return gpd.GeoDataFrame({'ID_1': np.arange(1, n + 1)}, geometry=geometries, crs=4326)
+
+
+def write_tiles(folder, days=8, step=.1, seed=0):
+    """Daily east and west AgERA5-like files for 'DataLoader' merges, the west tile covers the part of Russia
+    across the antimeridian"""
+
+    rng = np.random.default_rng(seed)
+    lat = np.round(np.arange(83, 40, -step), 2)
+    tiles = {'east': np.round(np.arange(18, 180, step), 2), 'west': np.round(np.arange(-180, -168, step), 2)}
+
+    for side, lon in tiles.items():
+        os.makedirs(f'{folder}/{side}', exist_ok=True)
+
+        for day in pd.date_range('2021-07-01', periods=days):
+            ds = xr.Dataset({'Wind_Speed_10m_Mean': (['time', 'lat', 'lon'],
+                                                     rng.gamma(2, 2, (1, len(lat), len(lon))).astype(np.float32))},
+                            coords={'time': [day], 'lat': lat, 'lon': lon})
+            ds.to_netcdf(f'{folder}/{side}/{side}_{day:%Y%m%d}.nc')
+
+    return f'{folder}/east', f'{folder}/west'
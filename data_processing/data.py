@@ -1,47 +1,73 @@
+from time import time
 from argparse import ArgumentParser
+from datetime import date, timedelta
+
+from processing import telemetry
+from processing.pipeline import Pipeline, run_years, print_summary
+
+
+def get_years(years):
+    start, _, end = years.partition('-')
+
+    return list(range(int(start), int(end or start) + 1))
+
+
+def get_chunks(chunks):
+    return dict(zip(['time', 'y', 'x'], map(int, chunks.split(','))))
 
-from processing.fwi import FWI
-from processing.cds import APILoader
-from processing.fires import Fires
-from processing.forest import Forest
-from processing.weather import DataLoader
-from processing.dataset import Dataset
 
 parser = ArgumentParser()
-parser.add_argument('-y', '--year', type=int, required=True)
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument('-y', '--year', type=int)
+group.add_argument('--years', type=get_years, metavar='START-END')
+parser.add_argument('-w', '--workers', type=int)
+parser.add_argument('-u', '--update', nargs='?', const=str(date.today() - timedelta(days=1)), metavar='DATE')
 parser.add_argument('-d', '--download', action='store_true')
-parser.add_argument('--fwi', action='store_true')
+parser.add_argument('--fwi', nargs='?', const='fused', choices=['fused', 'scalar', 'vector', 'numba'])
+parser.add_argument('--warm-start', action='store_true')
+parser.add_argument('--lazy', action='store_true')
 parser.add_argument('--forest', action='store_true')
 parser.add_argument('--fires', action='store_true')
+parser.add_argument('--cache', action='store_true')
+parser.add_argument('--keep-inputs', action='store_true')
+parser.add_argument('--backend', default='netcdf', choices=['netcdf', 'zarr'])
+parser.add_argument('--chunks', type=get_chunks, metavar='TIME,Y,X')
+parser.add_argument('--compact', action='store_true',
+                    help='store FWI and codes as scaled int16, forest cover as uint8 percent and counts as int32')
+parser.add_argument('--telemetry', metavar='PATH', help='append the timings of every stage to a JSON lines file')
+parser.add_argument('--profile', nargs='*', choices=Pipeline.stages, metavar='STAGE',
+                    help='profile the stages with cProfile next to the telemetry file, all stages if none given')
 
-args = parser.parse_args()
-
-year = args.year
-
-download = args.download
-fwi_flag = args.fwi
-forest_flag = args.forest
-fires_flag = args.fires
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-if download:
-    al = APILoader(year)
-    al.get_raw_weather()
-    al.get_land()
+    if args.profile is not None and args.telemetry is None:
+        parser.error('--profile requires --telemetry')
 
-if fwi_flag:
-    dl = DataLoader(year)
-    dl.get_weather_ds()
+    options = {'download': args.download,
+               'fwi': args.fwi,
+               'warm_start': args.warm_start,
+               'forest': args.forest,
+               'fires': args.fires,
+               'update': args.update,
+               'cache': args.cache,
+               'cleanup': not args.keep_inputs,
+               'lazy': args.lazy,
+               'backend': args.backend,
+               'chunks': args.chunks,
+               'compact': args.compact,
+               'telemetry': args.telemetry,
+               'profile': True if args.profile == [] else args.profile or ()}
 
-    fwi = FWI(year)
-    fwi.get_fwi()
+    start = time()
 
-if forest_flag:
-    forest = Forest(year)
-    forest.get_forest()
+    if args.years:
+        results = run_years(args.years, workers=args.workers, **options)
+    else:
+        pipeline = Pipeline(args.year, **options)
+        results = {args.year: (pipeline.run(), None)}
 
-if fires_flag:
-    fires = Fires(year)
-    fires.get_counts_ds()
+    print_summary(results)
 
-dataset = Dataset(year=year, region='rus')
-dataset.combine()
+    if args.telemetry:
+        print(telemetry.summarize(args.telemetry, since=start).round(2).to_string())
@@ -1,16 +1,18 @@
 import os
 import pickle
-import cdsapi
-import zipfile
+
+from processing.downloads import DownloadManager
 
 
 class APILoader:
-    def __init__(self, year):
+    def __init__(self, year, client=None, workers=8):
         self.year = year
         self.root = '/Users/artembadmaev/IT/thesis'
         self.hours = ['06', '09', '12', '15', '18']
         self.components = ['wind', 'humidity', 'temperature', 'precipitation']
 
+        self.manager = DownloadManager(client=client, workers=workers)
+
     def get_land(self):
         year = self.year
         root = self.root
@@ -23,12 +25,12 @@ class APILoader:
         else:
             request = f'{root}/data_processing/processing/api_requests/land_post2016.pkl'
 
-        self.get_data(dataset, request, path)
+        self.manager.run([(dataset, self.get_request(request), path)])
 
         file = [file for file in os.listdir(path) if file.endswith('.nc')][0]
         os.replace(f'{path}/{file}', f'{path}.nc')
 
-    def get_raw_weather(self):
+    def get_raw_weather(self, dates=None):
         root = self.root
         dataset = 'sis-agrometeorological-indicators'
 
@@ -36,6 +38,8 @@ class APILoader:
         hours = self.hours
         components = self.components
 
+        jobs = []
+
         for comp in components:
             if comp == 'humidity':
                 for hour in hours:
@@ -45,8 +49,8 @@ class APILoader:
                     req_west = f'{root}/data_processing/processing/api_requests/{comp}_west_{hour}.pkl'
                     req_east = f'{root}/data_processing/processing/api_requests/{comp}_east_{hour}.pkl'
 
-                    self.get_data(dataset, req_west, data_west)
-                    self.get_data(dataset, req_east, data_east)
+                    jobs.extend(self.get_jobs(dataset, req_west, data_west, dates))
+                    jobs.extend(self.get_jobs(dataset, req_east, data_east, dates))
             else:
                 data_west = f'{root}/data/temp/fwi/weather/weather_components/{comp}/west/{year}'
                 data_east = f'{root}/data/temp/fwi/weather/weather_components/{comp}/east/{year}'
@@ -54,24 +58,25 @@ class APILoader:
                 req_west = f'{root}/data_processing/processing/api_requests/{comp}_west.pkl'
                 req_east = f'{root}/data_processing/processing/api_requests/{comp}_east.pkl'
 
-                self.get_data(dataset, req_west, data_west)
-                self.get_data(dataset, req_east, data_east)
+                jobs.extend(self.get_jobs(dataset, req_west, data_west, dates))
+                jobs.extend(self.get_jobs(dataset, req_east, data_east, dates))
+
+        self.manager.run(jobs)
 
-    def get_data(self, dataset, req_path, data_path):
+    def get_jobs(self, dataset, req_path, data_path, dates=None):
+        if dates is None:
+            return [(dataset, self.get_request(req_path), data_path)]
+
+        return [(dataset, self.get_request(req_path, date), data_path) for date in dates]
+
+    def get_request(self, req_path, date=None):
         with open(req_path, 'rb') as f:
             request = pickle.load(f)
 
         request['year'] = self.year
-        c = cdsapi.Client()
-
-        os.makedirs(data_path, exist_ok=True)
-
-        c.retrieve(
-            dataset,
-            request,
-            f'{data_path}/data.zip')
 
-        with zipfile.ZipFile(f'{data_path}/data.zip', 'r') as zf:
-            zf.extractall(data_path)
+        if date is not None:
+            request['month'] = f'{date.month:02d}'
+            request['day'] = f'{date.day:02d}'
 
-        os.remove(f'{data_path}/data.zip')
+        return request
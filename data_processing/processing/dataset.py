@@ -1,31 +1,43 @@
 import os
+import hashlib
+import netCDF4
+import numpy as np
+import pandas as pd
 import xarray as xr
 import geopandas as gpd
 
 from utils import CustomCRS
+from processing import telemetry, encoding
+from rasterio.features import geometry_mask, rasterize
 
 
 class Dataset:
-    def __init__(self, year=None, region='rus'):
-        self.year = year
-        self.root = '/Users/artembadmaev/IT/thesis'
+    regions = {'rus': None,
+               'sib': [4, 10, 13, 14, 21, 27, 31, 33, 40, 45, 51, 65, 75, 77, 87],
+               'bur': [10]}
+    rasters = {}
 
-        self.crs = CustomCRS().get_crs()
-        self.geo = gpd.read_file(f'{self.root}/data_processing/regions.json')
-
-        if region == 'rus':
-            pass
-        elif region == 'sib':
-            self.geo = self.geo[self.geo.ID_1.isin(
-                [4, 10, 13, 14, 21, 27, 31, 33, 40, 45, 51, 65, 75, 77, 87])]
-        elif region == 'bur':
-            self.geo = self.geo[self.geo.ID_1 == 10]
-        else:
+    def __init__(self, year=None, region='rus', cleanup=True, backend='netcdf', geo=None, compact=False):
+        if backend not in ['netcdf', 'zarr']:
+            raise ValueError(
+                "Incorrect value passed in 'backend' argument! Should be either 'netcdf' or 'zarr'.")
+
+        if region not in self.regions:
             raise ValueError(
                 "Incorrect value passed in 'regions' argument! Should be either 'rus', 'sib', or 'bur'.")
 
-        self.geo = self.geo.set_crs(4326)
-        self.geo = self.geo.to_crs(self.crs)
+        self.year = year
+        self.region = region
+        self.cleanup = cleanup
+        self.backend = backend
+        self.compact = compact
+        self.root = '/Users/artembadmaev/IT/thesis'
+
+        self.crs = CustomCRS().get_crs()
+        self.geo_path = f'{self.root}/data_processing/regions.json'
+        # read on first use, clipping with a cached mask does not need the polygons at all
+        self.features = geo
+        self.geo_given = geo is not None
 
     def load_ds(self, var):
         if self.year is None:
@@ -36,19 +48,120 @@ class Dataset:
         year = self.year
 
         ds = xr.open_dataset(f'{root}/data/temp/{var}/{year}.nc')
-        os.remove(f'{root}/data/temp/{var}/{year}.nc')
+        if self.cleanup:
+            os.remove(f'{root}/data/temp/{var}/{year}.nc')
 
         return ds
 
-    def clip(self, ds):
-        geo = self.geo
-        crs = self.crs
+    def get_geo(self, region=None):
+        """Get the polygons of 'region' ('region' of the dataset by default) in the custom CRS"""
+
+        if self.features is None:
+            self.features = gpd.read_file(self.geo_path)
+
+        geo = self.features
+        ids = self.regions[region or self.region]
+
+        if ids is not None:
+            geo = geo[geo.ID_1.isin(ids)]
+
+        geo = geo.set_crs(4326)
+        geo = geo.to_crs(self.crs)
+
+        return geo
+
+    def get_geo_key(self):
+        """Identify the polygons by the size and modification time of 'regions.json', or by the geometries
+        themselves if they were passed in"""
+
+        if self.geo_given:
+            return hashlib.sha256(b''.join(self.features.geometry.to_wkb())).hexdigest()
+
+        stat = os.stat(self.geo_path)
+
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def get_raster(self, ds, name, compute):
+        """Get a (y, x) raster of the polygons on the grid of 'ds' made by 'compute(grid, transform)', cached
+        in memory and on disk by grid geometry, 'name' and the polygons"""
+
+        key = hashlib.sha256()
+        key.update(ds.y.to_numpy().tobytes())
+        key.update(ds.x.to_numpy().tobytes())
+        key.update(self.crs.to_wkt().encode())
+        key.update(f'{name}:{self.get_geo_key()}'.encode())
+        key = key.hexdigest()[:16]
+
+        path = f'{self.root}/data/temp/masks/{key}.npy'
+
+        if key not in self.rasters:
+            if os.path.exists(path):
+                self.rasters[key] = np.load(path)
+            else:
+                grid = xr.DataArray(np.empty((len(ds.y), len(ds.x)), dtype=bool),
+                                    coords={'y': ds.y.values, 'x': ds.x.values}, dims=['y', 'x'])
+                grid = grid.rio.write_crs(self.crs)
+
+                self.rasters[key] = compute(grid.shape, grid.rio.transform(recalc=True))
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.save(path, self.rasters[key])
+
+        return self.rasters[key]
+
+    def get_mask(self, ds, region=None):
+        """Get the (y, x) mask of the pixels of 'ds' whose centers fall inside 'region', the same pixels as
+        'rio.clip' keeps"""
+
+        region = region or self.region
+
+        return self.get_raster(ds, f'{region}:{self.regions[region]}', lambda shape, transform: geometry_mask(
+            self.get_geo(region).geometry.values, out_shape=shape, transform=transform, invert=True))
 
-        ds = ds.rio.write_crs(crs)
-        ds = ds.rio.set_spatial_dims(x_dim='x', y_dim='y')
-        ds = ds.rio.clip(geo.geometry.values)
+    def get_labels(self, ds):
+        """Get the (y, x) grid of the 'ID_1' of the region containing every pixel center of 'ds', 0 outside
+        of all regions"""
 
-        ds = ds.drop('spatial_ref')
+        def compute(shape, transform):
+            geo = self.get_geo('rus')
+
+            return rasterize(zip(geo.geometry.values, geo.ID_1.values), out_shape=shape, transform=transform,
+                             fill=0, dtype='int32')
+
+        return self.get_raster(ds, 'labels', compute)
+
+    def clip(self, ds, region=None):
+        """Mask the pixels of 'ds' outside of 'region' and crop it to the extent of the region"""
+
+        mask = self.get_mask(ds, region)
+
+        rows = np.flatnonzero(mask.any(axis=1))
+        columns = np.flatnonzero(mask.any(axis=0))
+
+        if len(rows) == 0:
+            raise ValueError(
+                f"No pixels of the dataset fall inside '{region or self.region}'!")
+
+        mask = xr.DataArray(mask, coords={'y': ds.y, 'x': ds.x}, dims=['y', 'x'])
+        window = {'y': slice(rows[0], rows[-1] + 1), 'x': slice(columns[0], columns[-1] + 1)}
+
+        ds = ds.isel(window)
+        mask = mask.isel(window)
+
+        for var in list(ds.data_vars):
+            if 'y' not in ds[var].dims or 'x' not in ds[var].dims:
+                continue
+
+            if np.issubdtype(ds[var].dtype, np.floating):
+                ds[var] = ds[var].where(mask)
+            else:
+                ds[var] = ds[var].where(mask, ds[var].encoding.get('_FillValue', 0))
+
+        # the attributes 'rio.clip' gives to the coordinates, without the copies of the data 'rio' makes
+        ds = ds.assign_coords(
+            x=ds.x.assign_attrs(axis='X', long_name='longitude', standard_name='longitude', units='degrees_east'),
+            y=ds.y.assign_attrs(axis='Y', long_name='latitude', standard_name='latitude', units='degrees_north'))
+        ds = ds.drop_vars('spatial_ref', errors='ignore')
 
         for var in list(ds.data_vars):
             if 'grid_mapping' in ds[var].attrs.keys():
@@ -56,17 +169,242 @@ class Dataset:
 
         return ds
 
-    def combine(self):
-        root = self.root
-        year = self.year
+    def clip_regions(self, ds, regions):
+        """Clip 'ds' to every region of 'regions' in one pass over the cached masks"""
+
+        return {region: self.clip(ds, region) for region in regions}
+
+    def get_zonal_stats(self, ds, variables=None, chunk=16):
+        """Daily statistics of every variable of 'ds' over every region of 'regions.json' as a tidy table of
+        'time', 'ID_1', 'variable', 'count' (valid pixels), 'sum', 'mean', 'std' and 'positive' (pixels
+        above 0, e.g. pixels with fires for 'counts').
+
+        Pixels are labelled by region once, a pixel inside overlapping polygons goes to the last of them.
+        Then 'chunk' days of a variable are reduced at once with 'np.bincount' over (day, region) bins.
+        Variables without a time dimension, like 'forest_cover', are reduced once and repeated for every day"""
+
+        labels = self.get_labels(ds).reshape(-1)
+        ids = np.unique(labels[labels > 0])
+        # bin of every pixel of 'chunk' days, bin 0 of every day collects the pixels outside of all regions
+        regions = np.searchsorted(np.r_[0, ids], labels)
+        bins = (np.arange(chunk)[:, np.newaxis] * (len(ids) + 1) + regions).reshape(-1)
+
+        variables = variables or [var for var in ds.data_vars if {'y', 'x'} <= set(ds[var].dims)]
+        times = ds.time.values if 'time' in ds.dims else np.array([np.datetime64('NaT')])
+
+        tables = []
+
+        for var in variables:
+            da = ds[var]
+            static = 'time' not in da.dims
+
+            if static:
+                da = da.expand_dims(time=1)
+
+            da = da.transpose('time', 'y', 'x')
+            stats = []
+
+            for start in range(0, da.sizes['time'], chunk):
+                arr = da.isel(time=slice(start, start + chunk)).to_numpy().reshape(-1)
+                days = len(arr) // len(labels)
+
+                valid = np.isfinite(arr)
+                arr = np.where(valid, arr, 0).astype(np.float64)
+                day_bins = bins[:len(arr)]
+                size = days * (len(ids) + 1)
+
+                sums = np.stack([np.bincount(day_bins, weights=valid, minlength=size),
+                                 np.bincount(day_bins, weights=arr, minlength=size),
+                                 np.bincount(day_bins, weights=arr * arr, minlength=size),
+                                 np.bincount(day_bins, weights=arr > 0, minlength=size)], axis=1)
+
+                stats.append(sums.reshape(days, len(ids) + 1, 4)[:, 1:].reshape(-1, 4))
 
-        fwi = self.load_ds('fwi').FWI
-        forest = self.load_ds('forest').forest_cover.drop('spatial_ref')
-        fires = self.load_ds('fires').counts
+            stats = np.concatenate(stats)
 
-        ds = xr.merge([fwi, forest, fires])
-        ds = self.clip(ds)
+            if static:
+                stats = np.tile(stats, (len(times), 1))
 
-        ds.to_netcdf(f'{root}/data/{year}.nc')
+            count, total, squares, positive = stats.T
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+                std = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+
+            tables.append(pd.DataFrame({'time': np.repeat(times, len(ids)),
+                                        'ID_1': np.tile(ids, len(times)),
+                                        'variable': var,
+                                        'count': count.astype(np.int64),
+                                        'sum': total,
+                                        'mean': mean,
+                                        'std': std,
+                                        'positive': positive.astype(np.int64)}))
+
+        return pd.concat(tables, ignore_index=True)
+
+    def get_path(self):
+        """Get the yearly file of the 'netcdf' backend or the store shared by all years of the 'zarr' backend"""
+
+        if self.backend == 'zarr':
+            return f'{self.root}/data/dataset.zarr'
+
+        return f'{self.root}/data/{self.year}.nc'
+
+    def exists(self):
+        path = self.get_path()
+
+        if self.backend == 'zarr':
+            return os.path.exists(f'{path}/{self.year}')
+
+        return os.path.exists(path)
+
+    def combine(self, append=False, chunks=None, complevel=3):
+        path = self.get_path()
+        append = append and self.exists()
+
+        with telemetry.span('open'):
+            fwi = self.load_ds('fwi').FWI
+
+            if append:
+                fires = self.load_ds('fires').counts
+                ds = xr.merge([fwi, fires])
+            else:
+                forest = self.load_ds('forest').forest_cover.drop('spatial_ref')
+                fires = self.load_ds('fires').counts
+                ds = xr.merge([fwi, forest, fires])
+
+        with telemetry.span('clip'):
+            ds = self.clip(ds)
+
+        with telemetry.span('write'):
+            if self.backend == 'zarr':
+                self.write_zarr(ds, path, str(self.year), append=append, chunks=chunks, complevel=complevel,
+                                compact=self.compact)
+            elif append:
+                self.append_nc(ds, path)
+            else:
+                encoding.to_netcdf(ds, path, compact=self.compact, chunks=chunks, complevel=complevel,
+                                   unlimited_dims=['time'])
+
+        return ds
+
+    def get_missing_dates(self, end_date):
+        """Get the dates between the last day stored for 'year' and 'end_date'"""
+
+        if self.year is None:
+            raise ValueError(
+                "'year' argument is not defined!")
+
+        start_date = pd.Timestamp(year=self.year, month=1, day=1)
+        end_date = min(pd.Timestamp(end_date), pd.Timestamp(year=self.year, month=12, day=31))
+
+        if self.exists():
+            with self.open_year() as ds:
+                start_date = pd.Timestamp(ds.time.values[-1]) + pd.Timedelta(days=1)
+
+        return pd.date_range(start_date, end_date, freq='D')
+
+    def open_year(self):
+        if self.backend == 'zarr':
+            return xr.open_zarr(self.get_path(), group=str(self.year))
+
+        return xr.open_dataset(self.get_path())
+
+    @staticmethod
+    def append_nc(ds, path):
+        """Write the new days of 'ds' to the end of the unlimited time dimension of an existing file"""
+
+        with netCDF4.Dataset(path, 'a') as nc:
+            if not nc.dimensions['time'].isunlimited():
+                raise ValueError(
+                    f"{path} has a fixed 'time' dimension, rebuild it with 'combine()' before appending!")
+
+            nc_time = nc.variables['time']
+            calendar = getattr(nc_time, 'calendar', 'standard')
+
+            last_date = netCDF4.num2date(nc_time[-1], nc_time.units, calendar,
+                                         only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+            ds = ds.sel(time=slice(pd.Timestamp(last_date) + pd.Timedelta(days=1), None))
+            ds = ds.reindex(y=nc.variables['y'][:], x=nc.variables['x'][:], method='nearest', tolerance=1e-6)
+
+            start = len(nc_time)
+            stop = start + len(ds.time)
+
+            nc_time[start:stop] = netCDF4.date2num(pd.to_datetime(ds.time.values).to_pydatetime(),
+                                                   nc_time.units, calendar)
+
+            for var in list(ds.data_vars):
+                if 'time' not in ds[var].dims:
+                    continue
+
+                arr = ds[var].transpose('time', 'y', 'x').to_numpy()
+
+                # netCDF4 packs the values of compact files itself, but only clips and fills masked ones
+                if nc.variables[var].dtype.kind in 'iu':
+                    arr = np.clip(arr, *encoding.get_range(var))
+
+                nc.variables[var][start:stop] = np.ma.masked_invalid(arr)
+
+        return ds
+
+    @staticmethod
+    def get_encoding(ds, chunks=None, complevel=3, compact=False):
+        """Chunk every variable along time/y/x and compress the chunks with zstd, with 'compact' the variables
+        are also packed into small integers"""
+
+        import zarr
+
+        chunks = {'time': 8, 'y': 128, 'x': 128, **(chunks or {})}
+
+        if int(zarr.__version__.split('.')[0]) >= 3:
+            from zarr.codecs import BloscCodec
+            compression = {'compressors': [BloscCodec(cname='zstd', clevel=complevel, shuffle='shuffle')]}
+        else:
+            from numcodecs import Blosc
+            compression = {'compressor': Blosc(cname='zstd', clevel=complevel, shuffle=Blosc.SHUFFLE)}
+
+        packing = encoding.get_packing(ds) if compact else {}
+
+        return {var: {'chunks': tuple(min(chunks.get(dim, size), size) for dim, size in ds[var].sizes.items()),
+                      **compression, **packing.get(var, {})}
+                for var in ds.data_vars}
+
+    @staticmethod
+    def write_zarr(ds, path, group, append=False, chunks=None, complevel=3, compact=False):
+        """Write one year as a group of the store at 'path', with 'append' only the days after the last stored
+        day are written and the chunks of earlier days are left untouched. Appended days are packed like the
+        days already stored"""
+
+        if compact:
+            ds = encoding.pack(ds.copy())
+
+        if not append:
+            ds.to_zarr(path, group=group, mode='w', encoding=Dataset.get_encoding(ds, chunks, complevel, compact))
+            return ds
+
+        with xr.open_zarr(path, group=group) as store:
+            last_date = pd.Timestamp(store.time.values[-1])
+            y, x = store.y.values, store.x.values
+
+        ds = ds.sel(time=slice(last_date + pd.Timedelta(days=1), None))
+        ds = ds.reindex(y=y, x=x, method='nearest', tolerance=1e-6)
+
+        if len(ds.time):
+            ds.to_zarr(path, group=group, append_dim='time')
 
         return ds
+
+    @staticmethod
+    def open_zarr(path, start=None, end=None):
+        """Lazily open the days between 'start' and 'end' across the yearly groups of the store, 'forest_cover'
+        is repeated along time of its year"""
+
+        years = sorted(int(name) for name in os.listdir(path) if name.isdigit())
+
+        start = pd.Timestamp(start) if start is not None else pd.Timestamp(year=years[0], month=1, day=1)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp(year=years[-1], month=12, day=31)
+
+        groups = [xr.open_zarr(path, group=str(year)).sel(time=slice(start, end))
+                  for year in years if start.year <= year <= end.year]
+
+        return xr.concat(groups, dim='time', data_vars='all')
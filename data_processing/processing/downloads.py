@@ -0,0 +1,124 @@
+import os
+import json
+import random
+import shutil
+import hashlib
+import zipfile
+import threading
+
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class DownloadManager:
+    def __init__(self, client=None, workers=8, retries=5, backoff=2.):
+        self.client = client
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        """Create the CDS client once and share it between all requests"""
+
+        with self.lock:
+            if self.client is None:
+                import cdsapi
+                self.client = cdsapi.Client()
+
+        return self.client
+
+    def run(self, jobs):
+        """Retrieve every (dataset, request, data_path) job concurrently, raising after all jobs finish
+        if any of them failed"""
+
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.retrieve, *job): job for job in jobs}
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append((futures[future][2], e))
+
+        if errors:
+            raise RuntimeError(
+                '{} of {} downloads failed: {}'.format(len(errors), len(jobs),
+                                                       '; '.join(f'{path}: {e}' for path, e in errors)))
+
+    @staticmethod
+    def get_key(dataset, request):
+        return hashlib.sha256(json.dumps([dataset, request], sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def retrieve(self, dataset, request, data_path):
+        """Download and extract one request, skipped if it was already extracted by a previous run"""
+
+        key = self.get_key(dataset, request)
+        done = f'{data_path}/.{key}.done'
+        target = f'{data_path}/{key}.zip'
+
+        if self.is_done(done, data_path):
+            return False
+
+        os.makedirs(data_path, exist_ok=True)
+
+        for attempt in range(self.retries):
+            try:
+                self.get_client().retrieve(dataset, request, target)
+                members = self.extract(target, data_path)
+                break
+            except Exception:
+                if os.path.exists(target):
+                    os.remove(target)
+
+                if attempt == self.retries - 1:
+                    raise
+
+                sleep(self.backoff ** attempt * (1 + random.random()))
+
+        os.remove(target)
+
+        with open(done, 'w') as f:
+            json.dump(members, f)
+
+        return True
+
+    @staticmethod
+    def is_done(done, data_path):
+        """Check that a request was extracted before and its files are still in place"""
+
+        if not os.path.exists(done):
+            return False
+
+        with open(done) as f:
+            members = json.load(f)
+
+        return all(os.path.exists(f'{data_path}/{member}') for member in members)
+
+    @staticmethod
+    def extract(zip_path, data_path):
+        """Extract members one by one through a temporary file, keeping members extracted earlier"""
+
+        members = []
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            for member in zf.infolist():
+                path = f'{data_path}/{member.filename}'
+
+                if not member.is_dir():
+                    members.append(member.filename)
+
+                if member.is_dir() or (os.path.exists(path) and os.path.getsize(path) == member.file_size):
+                    continue
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                with zf.open(member) as src, open(f'{path}.part', 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+
+                os.replace(f'{path}.part', path)
+
+        return members
@@ -0,0 +1,96 @@
+import warnings
+import numpy as np
+
+
+# packed type and resolution of every variable written by the pipeline, readers get floats back through the
+# CF 'scale_factor' and '_FillValue' attributes, float32 ones as the scale factors are float32
+packing = {'FWI': {'dtype': 'int16', 'scale_factor': .01},
+           'FFMC': {'dtype': 'int16', 'scale_factor': .01},
+           'DMC': {'dtype': 'int16', 'scale_factor': .1},
+           'DC': {'dtype': 'int16', 'scale_factor': .1},
+           'Wind_Speed_10m_Mean': {'dtype': 'int16', 'scale_factor': .01},
+           'forest_cover': {'dtype': 'uint8', 'scale_factor': .01},
+           'counts': {'dtype': 'int32', 'scale_factor': 1}}
+
+fill_values = {'int16': np.iinfo(np.int16).min, 'uint8': np.iinfo(np.uint8).max, 'int32': -1}
+
+
+def get_packing(ds):
+    """CF encoding of the packed variables of 'ds'"""
+
+    encoding = {}
+
+    for var, spec in packing.items():
+        if var not in ds.data_vars:
+            continue
+
+        encoding[var] = {'dtype': spec['dtype'], '_FillValue': fill_values[spec['dtype']]}
+
+        if spec['scale_factor'] != 1:
+            encoding[var].update({'scale_factor': np.float32(spec['scale_factor']), 'add_offset': np.float32(0)})
+
+    return encoding
+
+
+def get_range(var):
+    """Smallest and largest values of 'var' the packed type can hold, its fill value excluded"""
+
+    info = np.iinfo(packing[var]['dtype'])
+    fill = fill_values[packing[var]['dtype']]
+
+    low = info.min + 1 if fill == info.min else 0 if fill == -1 else info.min
+    high = info.max - 1 if fill == info.max else info.max
+
+    return low * packing[var]['scale_factor'], high * packing[var]['scale_factor']
+
+
+def pack(ds):
+    """Clip the packed variables of 'ds' to the range of their packed types, integers would overflow silently"""
+
+    for var in ds.data_vars:
+        if var not in packing:
+            continue
+
+        low, high = get_range(var)
+        arr = ds[var].to_numpy()
+
+        with np.errstate(invalid='ignore'):
+            outside = (arr < low) | (arr > high)
+
+        if outside.any():
+            warnings.warn(f"{outside.sum()} values of '{var}' are outside [{low}, {high}] and are clipped.")
+            ds[var] = ds[var].clip(low, high)
+
+    return ds
+
+
+def get_encoding(ds, chunks=None, complevel=4):
+    """NetCDF4 encoding of 'ds' in compact mode: packed variables, zlib with shuffle and (time, y, x) chunks"""
+
+    chunks = {'time': 8, 'y': 128, 'x': 128, **(chunks or {})}
+    encoding = get_packing(ds)
+
+    for var in ds.data_vars:
+        sizes = ds[var].sizes
+
+        if not sizes:
+            continue
+
+        encoding[var] = {**encoding.get(var, {}),
+                         'zlib': True,
+                         'complevel': complevel,
+                         'shuffle': True,
+                         'chunksizes': tuple(min(chunks.get(dim, size), size) for dim, size in sizes.items())}
+
+    return encoding
+
+
+def to_netcdf(ds, path, compact=False, chunks=None, complevel=4, **kwargs):
+    """Write 'ds' as is or, with 'compact', packed and compressed"""
+
+    if not compact:
+        return ds.to_netcdf(path, **kwargs)
+
+    ds = pack(ds.copy())
+
+    return ds.to_netcdf(path, encoding=get_encoding(ds, chunks, complevel), **kwargs)
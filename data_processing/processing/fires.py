@@ -1,16 +1,19 @@
 import os
+import warnings
 import numpy as np
 import xarray as xr
 import pandas as pd
-import geopandas as gpd
 
 from utils import CustomCRS
+from processing import telemetry, encoding
 from numpy.lib.stride_tricks import sliding_window_view
 
 
 class Fires:
-    def __init__(self, year):
+    def __init__(self, year, cleanup=True, compact=False):
         self.year = year
+        self.cleanup = cleanup
+        self.compact = compact
         self.crs = CustomCRS().get_crs()
 
     @staticmethod
@@ -26,7 +29,49 @@ class Fires:
 
         return edges
 
+    @staticmethod
+    def get_indexes(values, edges):
+        """Get the bin of every value given 'get_edges' output, a value lying on the edge
+        between two bins falls into the lower one as with the '.cx' slicing"""
+
+        idx = np.searchsorted(edges[:, 1], values, side='left')
+        valid = (idx < len(edges)) & (values >= edges[0, 0])
+
+        return idx, valid
+
     def get_counts(self, data, grid):
+        return self.get_counts_chunks([data], grid)
+
+    def get_counts_chunks(self, chunks, grid):
+        lon_edges = self.get_edges(grid.x)
+        lat_edges = self.get_edges(grid.y)
+
+        counts = xr.Dataset(
+            data_vars={'counts': (['time', 'y', 'x'], np.zeros(grid.shape))},
+            coords={'time': grid.time.values,
+                    'y': lat_edges[:, 2],
+                    'x': lon_edges[:, 2]})
+
+        for chunk in chunks:
+            self.add_counts(counts.counts.values, chunk, lon_edges, lat_edges, grid.time.values)
+
+        return counts
+
+    def add_counts(self, counts_arr, data, lon_edges, lat_edges, times):
+        """Bin all points of 'data' at once and add them to the (time, y, x) 'counts_arr'"""
+
+        x_idx, x_valid = self.get_indexes(data.longitude.to_numpy(), lon_edges)
+        y_idx, y_valid = self.get_indexes(data.latitude.to_numpy(), lat_edges)
+
+        t_idx = pd.DatetimeIndex(times).get_indexer(pd.to_datetime(data.acq_date))
+        valid = x_valid & y_valid & (t_idx >= 0)
+
+        flat_idx = np.ravel_multi_index((t_idx[valid], y_idx[valid], x_idx[valid]), counts_arr.shape)
+        counts_arr += np.bincount(flat_idx, minlength=counts_arr.size).reshape(counts_arr.shape)
+
+        return counts_arr
+
+    def get_counts_cx(self, data, grid):
         lon_edges = self.get_edges(grid.x)
         lat_edges = self.get_edges(grid.y)
 
@@ -62,26 +107,87 @@ class Fires:
 
         return counts
 
-    def get_counts_ds(self):
+    @staticmethod
+    def get_source_path(path):
+        """Find the detections archive saved as JSON, CSV or Parquet given its path without extension"""
+
+        for ext in ['json', 'csv', 'parquet']:
+            if os.path.exists(f'{path}.{ext}'):
+                return f'{path}.{ext}'
+
+        raise FileNotFoundError(
+            f'No VIIRS archive found at {path}.json, {path}.csv, or {path}.parquet!')
+
+    @staticmethod
+    def read_chunks(path, chunksize=500_000):
+        """Read 'longitude', 'latitude', and 'acq_date' of the detections in chunks of 'chunksize' rows"""
+
+        columns = ['longitude', 'latitude', 'acq_date']
+
+        if path.endswith('.csv'):
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+        elif path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+                yield batch.to_pandas()
+
+        else:
+            with open(path) as f:
+                char = f.read(1)
+                while char.isspace():
+                    char = f.read(1)
+
+            if char != '[':
+                for chunk in pd.read_json(path, lines=True, chunksize=chunksize):
+                    yield chunk[columns]
+                return
+
+            try:
+                import ijson
+            except ImportError:
+                warnings.warn("'ijson' is not installed, reading the whole JSON array into memory.")
+
+                df = pd.read_json(path)[columns]
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start:start + chunksize]
+                return
+
+            with open(path, 'rb') as f:
+                records = []
+
+                for record in ijson.items(f, 'item', use_float=True):
+                    records.append([record[column] for column in columns])
+
+                    if len(records) == chunksize:
+                        yield pd.DataFrame(records, columns=columns)
+                        records = []
+
+                if records:
+                    yield pd.DataFrame(records, columns=columns)
+
+    def get_counts_ds(self, chunksize=500_000):
         year = self.year
         new_crs = self.crs
         root = '/Users/artembadmaev/IT/thesis'
 
-        gdf = pd.read_json(f'{root}/data/temp/fires/viirs/{year}.json')
-        os.remove(f'{root}/data/temp/fires/viirs/{year}.json')
+        path = self.get_source_path(f'{root}/data/temp/fires/viirs/{year}')
+        da = xr.open_dataset(f'{root}/data/temp/fwi/{year}.nc').FWI
 
-        gdf = gdf[['longitude', 'latitude', 'acq_date']]
-        gdf.longitude = gdf.longitude - 18
-        gdf.acq_date = pd.to_datetime(gdf.acq_date)
-        gdf = gpd.GeoDataFrame(data=gdf,
-                               geometry=gpd.points_from_xy(gdf.longitude, gdf.latitude))
+        chunks = (chunk.assign(longitude=chunk.longitude - 18)
+                  for chunk in self.read_chunks(path, chunksize))
 
-        da = xr.open_dataset(f'{root}/data/temp/fwi/{year}.nc').FWI
+        with telemetry.span('count'):
+            counts = self.get_counts_chunks(chunks, da)
 
-        counts = self.get_counts(gdf, da)
+        if self.cleanup:
+            os.remove(path)
 
         counts = counts.rio.write_crs(new_crs)
         counts = counts.rio.set_spatial_dims(x_dim='x', y_dim='y')
-        counts.to_netcdf(f'{root}/data/temp/fires/{year}.nc')
+
+        with telemetry.span('write'):
+            encoding.to_netcdf(counts, f'{root}/data/temp/fires/{year}.nc', compact=self.compact)
 
         return counts
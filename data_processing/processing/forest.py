@@ -4,11 +4,15 @@ import xarray as xr
 
 from utils import CustomCRS
 from rasterio.enums import Resampling
+from processing import telemetry, encoding
+from processing.fires import Fires
 
 
 class Forest:
-    def __init__(self, year):
+    def __init__(self, year, cleanup=True, compact=False):
         self.year = year
+        self.cleanup = cleanup
+        self.compact = compact
         self.crs = CustomCRS().get_crs()
 
     @staticmethod
@@ -21,7 +25,92 @@ class Forest:
 
         return arr
 
-    def get_forest(self):
+    @staticmethod
+    def get_groups(idx):
+        """Get the starts and values of the runs of equal bins in a sorted array of bin indexes"""
+
+        starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+
+        return starts, idx[starts]
+
+    def aggregate_forest(self, da, match_da, chunk_rows=512):
+        """Get the share of forest pixels in every cell of 'match_da' straight from the 'lccs_class' raster.
+
+        The custom CRS only moves the prime meridian, so a source pixel falls into the cell containing its
+        longitude shifted by 18 degrees and wrapped to [-180, 180), the pixels across the antimeridian end up
+        in the easternmost cells. Blocks of 'chunk_rows' rows are read as uint8 flags and summed over the
+        columns and rows of every cell, separately for every run of columns with increasing cells"""
+
+        classes = da.flag_values[6:25]
+
+        x_edges = Fires.get_edges(match_da.x)
+        y_edges = Fires.get_edges(match_da.y)
+
+        x_idx, x_valid = Fires.get_indexes((da.lon.to_numpy() - 18 + 180) % 360 - 180, x_edges)
+        y_idx, y_valid = Fires.get_indexes(da.lat.to_numpy(), y_edges)
+
+        columns = np.flatnonzero(x_valid)
+        breaks = np.flatnonzero((np.diff(columns) != 1) | (np.diff(x_idx[columns]) < 0)) + 1
+        segments = []
+
+        for segment in np.split(columns, breaks):
+            x_starts, x_cells = self.get_groups(x_idx[segment])
+            x_sizes = np.diff(np.r_[x_starts, len(segment)])
+            segments.append((slice(segment[0], segment[-1] + 1), x_starts, x_cells, x_sizes))
+
+        forest = np.zeros((len(y_edges), len(x_edges)), dtype=np.int64)
+        total = np.zeros((len(y_edges), len(x_edges)), dtype=np.int64)
+
+        rows = np.flatnonzero(y_valid)
+
+        for start in range(rows[0], rows[-1] + 1, chunk_rows):
+            stop = min(start + chunk_rows, rows[-1] + 1)
+
+            y_starts, y_cells = self.get_groups(y_idx[start:stop])
+            y_sizes = np.diff(np.r_[y_starts, stop - start])
+
+            for lon, x_starts, x_cells, x_sizes in segments:
+                block = da.isel(lat=slice(start, stop), lon=lon).to_numpy()
+                flags = np.isin(block, classes).view(np.uint8)
+
+                sums = np.add.reduceat(flags, x_starts, axis=1, dtype=np.int32)
+                sums = np.add.reduceat(sums, y_starts, axis=0)
+
+                forest[np.ix_(y_cells, x_cells)] += sums
+                total[np.ix_(y_cells, x_cells)] += np.outer(y_sizes, x_sizes)
+
+        share = np.divide(forest, total, out=np.zeros(forest.shape), where=total > 0)
+
+        rda = xr.DataArray(share, name='forest_cover', dims=['y', 'x'],
+                           coords={'y': y_edges[:, 2], 'x': x_edges[:, 2]})
+        rda = rda.reindex(y=match_da.y, x=match_da.x)
+
+        return rda.rio.write_crs(self.crs)
+
+    def warp_forest(self, da, match_da):
+        """Get the forest share on the grid of 'match_da' by reprojecting the full resolution raster"""
+
+        with telemetry.span('reproject'):
+            da = da.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
+            da = da.rio.write_crs(4326)
+            da = da.rio.reproject(dst_crs=self.crs)
+            da = da.sel(x=slice(0, 174))
+
+        with telemetry.span('aggregate'):
+            da.values = self.get_forest_flags(da)
+
+            da = da.astype('float')
+            da = da.rename('forest_cover')
+
+            rda = da.rio.reproject_match(match_da, resampling=Resampling.average)
+            rda = rda.where(rda != 255, 0)
+
+        return rda
+
+    def get_forest(self, method='blocks', chunk_rows=512):
+        """Get the forest share on the FWI grid, 'blocks' aggregates the source pixels in blocks of rows,
+        'warp' reprojects the full resolution raster before averaging"""
+
         year = self.year
         new_crs = self.crs
 
@@ -32,23 +121,23 @@ class Forest:
         if year == 2021:
             da = xr.open_dataset(f'{root}/data/temp/forest/land/2020.nc').lccs_class.sel(
                 time='2020-01-01', lat=slice(83, 40))
-            os.remove(f'{root}/data/temp/forest/land/2020.nc')
+            if self.cleanup:
+                os.remove(f'{root}/data/temp/forest/land/2020.nc')
         else:
             da = xr.open_dataset(f'{root}/data/temp/forest/land/{year}.nc').lccs_class.sel(
                 time=f'{year}-01-01', lat=slice(83, 40))
-            os.remove(f'{root}/data/temp/forest/land/{year}.nc')
-
-        da = da.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-        da = da.rio.write_crs(4326)
-        da = da.rio.reproject(dst_crs=new_crs)
-        da = da.sel(x=slice(0, 174))
+            if self.cleanup:
+                os.remove(f'{root}/data/temp/forest/land/{year}.nc')
 
-        da.values = self.get_forest_flags(da)
+        if method == 'blocks':
+            with telemetry.span('aggregate'):
+                rda = self.aggregate_forest(da, match_da, chunk_rows)
 
-        da = da.astype('float')
-        da = da.rename('forest_cover')
+            with telemetry.span('write'):
+                encoding.to_netcdf(rda.to_dataset(), f'{root}/data/temp/forest/{year}.nc', compact=self.compact)
+            return
 
-        rda = da.rio.reproject_match(match_da, resampling=Resampling.average)
-        rda = rda.where(rda != 255, 0)
+        rda = self.warp_forest(da, match_da)
 
-        rda.to_netcdf(f'{root}/data/temp/forest/{year}.nc')
+        with telemetry.span('write'):
+            encoding.to_netcdf(rda.to_dataset(), f'{root}/data/temp/forest/{year}.nc', compact=self.compact)
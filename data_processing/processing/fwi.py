@@ -6,12 +6,21 @@ import xarray as xr
 from time import time
 from datetime import datetime
 
+from processing import telemetry, encoding
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 class FWI:
-    def __init__(self, year):
+    def __init__(self, year, cleanup=True, compact=False):
         self.year = year
+        self.cleanup = cleanup
+        self.compact = compact
 
-    def get_fwi(self):
+    def get_fwi(self, engine='fused', warm_start=False, update=False):
         root = '/Users/artembadmaev/IT/thesis'
         weather_read = f'{root}/data/temp/fwi/weather/{self.year}.nc'
         codes_write = f'{root}/data/temp/fwi/codes/{self.year}.nc'
@@ -19,36 +28,116 @@ class FWI:
 
         warnings.filterwarnings('ignore', category=RuntimeWarning)
 
-        codes = CodesComputation(weather_read, codes_write)
-        codes.get_codes_ds()
+        initials = None
+
+        if update:
+            with xr.open_dataset(weather_read) as weather:
+                start_date = weather.time.values[0]
+
+            initials = self.load_state(self.get_state_path(self.year), start_date)
+
+        if (warm_start or update) and initials is None:
+            initials = self.load_state(self.get_state_path(self.year - 1))
+
+        if engine == 'fused':
+            fwi = FusedComputation(weather_read, indexes_write, compact=self.compact)
+
+            with telemetry.span('fused'):
+                fwi.get_fwi_ds(initials)
+
+            self.save_state(fwi.state, fwi.ds, self.get_state_path(self.year))
+
+            if self.cleanup and os.path.exists(weather_read):
+                os.remove(weather_read)
 
-        if os.path.exists(weather_read):
+            return
+
+        codes = CodesComputation(weather_read, codes_write, engine=engine, compact=self.compact)
+
+        with telemetry.span('codes'):
+            codes.get_codes_ds(initials)
+
+        self.save_state(codes.state, codes.ds, self.get_state_path(self.year))
+
+        if self.cleanup and os.path.exists(weather_read):
             os.remove(weather_read)
 
-        fwi = IndexComputation(codes_write, indexes_write)
-        fwi.get_fwi_ds()
+        fwi = IndexComputation(codes_write, indexes_write, compact=self.compact)
+
+        with telemetry.span('index'):
+            fwi.get_fwi_ds()
 
         if os.path.exists(codes_write):
             os.remove(codes_write)
 
+    @staticmethod
+    def get_state_path(year):
+        root = '/Users/artembadmaev/IT/thesis'
+
+        return f'{root}/data/temp/fwi/state/{year}.nc'
+
+    @staticmethod
+    def save_state(state, ds, path):
+        """Save the last day's FFMC, DMC and DC grids so that the next run can start from them"""
+
+        state_ds = xr.Dataset(data_vars={code.upper(): (['y', 'x'], arr) for code, arr in state.items()},
+                              coords={'time': ds.time.values[-1],
+                                      'y': ds.y.values,
+                                      'x': ds.x.values})
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state_ds.to_netcdf(path)
+
+        return state_ds
+
+    @staticmethod
+    def load_state(path, start_date=None):
+        """Load FFMC, DMC and DC grids saved by 'save_state', or None if there is no checkpoint"""
+
+        if not os.path.exists(path):
+            return None
+
+        with xr.open_dataset(path) as state_ds:
+            if start_date is not None and state_ds.time.values + np.timedelta64(1, 'D') != start_date:
+                raise ValueError(
+                    f'Checkpoint {path} does not end on the day before {np.datetime_as_string(start_date, "D")}!')
+
+            return {code: state_ds[code.upper()].to_numpy() for code in ['ffmc', 'dmc', 'dc']}
+
 
 class Computation:
-    def __init__(self, read_path, write_path):
+    initials = {'ffmc': 85, 'dmc': 6, 'dc': 15}
+
+    def __init__(self, read_path, write_path, compact=False):
         self.ds = xr.open_dataset(read_path)
         self.write_to = write_path
+        self.compact = compact
+        self.state = {}
+
+    def get_initial(self, code_name, initial_value=None):
+        """Get the starting value of a code, either the default scalar or a per-pixel grid
+        with missing pixels falling back to the default"""
+
+        default = self.initials[code_name]
+
+        if initial_value is None:
+            return default
+
+        return np.where(np.isnan(initial_value), default, initial_value)
 
 
 class IndexComputation(Computation):
-    def __init__(self, read_path, write_path):
-        super().__init__(read_path, write_path)
+    def __init__(self, read_path, write_path, compact=False):
+        super().__init__(read_path, write_path, compact)
 
     def get_fwi_ds(self):
         ds = self.ds
         write_to = self.write_to
 
-        isi = self.compute_isi(ds.Wind_Speed_10m_Mean.to_numpy(), ds.FFMC.to_numpy())
-        bui = self.compute_bui(ds.DMC.to_numpy(), ds.DC.to_numpy())
-        fwi_arr = self.compute_fwi(isi, bui)
+        with telemetry.span('compute'):
+            isi = self.compute_isi(ds.Wind_Speed_10m_Mean.to_numpy(), ds.FFMC.to_numpy())
+            bui = self.compute_bui(ds.DMC.to_numpy(), ds.DC.to_numpy())
+            fwi_arr = self.compute_fwi(isi, bui)
 
         fwi_ds = xr.Dataset(data_vars={'FWI': (['time', 'y', 'x'], fwi_arr)},
                             coords={'time': ds.time.values,
@@ -56,7 +145,8 @@ class IndexComputation(Computation):
                                     'x': ds.x.values})
 
         if write_to is not None:
-            fwi_ds.to_netcdf(write_to)
+            with telemetry.span('write'):
+                encoding.to_netcdf(fwi_ds, write_to, compact=self.compact)
 
         return fwi_ds
 
@@ -97,13 +187,84 @@ class IndexComputation(Computation):
         return fwi
 
 
+class FusedComputation(Computation):
+    def __init__(self, read_path, write_path, compact=False):
+        super().__init__(read_path, write_path, compact)
+
+    def get_fwi_ds(self, initials=None):
+        ds = self.ds
+        write_to = self.write_to
+        initials = initials or {}
+
+        print('Started processing FWI at: {}'.format(datetime.now().time()))
+        start = time()
+
+        shape = (len(ds.y), len(ds.x))
+        month = ds.Month.to_numpy()
+
+        ffmc = np.full(shape, self.get_initial('ffmc', initials.get('ffmc')), dtype=float)
+        dmc = np.full(shape, self.get_initial('dmc', initials.get('dmc')), dtype=float)
+        dc = np.full(shape, self.get_initial('dc', initials.get('dc')), dtype=float)
+
+        empty = np.full(shape, True)
+        fwi_arr = np.empty((len(ds.time), *shape))
+
+        with np.errstate(all='ignore'), telemetry.span('compute'):
+            for day in range(len(ds.time)):
+                t, h, w, p = self.get_weather_slice(ds, day)
+                empty &= np.all(np.isnan([t, h, w, p]), axis=0)
+
+                ffmc = CodesComputation.compute_ffmc_arr(t, h, w, p, ffmc)
+                dmc = CodesComputation.compute_dmc_arr(t, h, p, month[day], dmc)
+                dc = CodesComputation.compute_dc_arr(t, p, month[day], dc)
+
+                isi = IndexComputation.compute_isi(w, ffmc)
+                bui = IndexComputation.compute_bui(dmc, dc)
+                fwi_arr[day] = IndexComputation.compute_fwi(isi, bui)
+
+        ffmc[empty] = np.nan
+        self.state = {'ffmc': ffmc, 'dmc': dmc, 'dc': dc}
+
+        end = time()
+        print('FWI ready. {:.2f} min elapsed'.format((end - start) / 60))
+
+        fwi_ds = xr.Dataset(data_vars={'FWI': (['time', 'y', 'x'], fwi_arr)},
+                            coords={'time': ds.time.values,
+                                    'y': ds.y.values,
+                                    'x': ds.x.values})
+
+        if write_to is not None:
+            with telemetry.span('write'):
+                encoding.to_netcdf(fwi_ds, write_to, compact=self.compact)
+
+        return fwi_ds
+
+    @staticmethod
+    def get_weather_slice(ds, day):
+        variables = ['Temperature_Air_2m_Mean_24h', 'Relative_Humidity_min', 'Wind_Speed_10m_Mean',
+                     'Precipitation_Flux']
+
+        return [ds[variable][day].to_numpy().astype(float) for variable in variables]
+
+
 class CodesComputation(Computation):
-    def __init__(self, read_path, write_path):
-        super().__init__(read_path, write_path)
+    def __init__(self, read_path, write_path, engine='vector', compact=False):
+        super().__init__(read_path, write_path, compact)
+
+        if engine not in ['scalar', 'vector', 'numba']:
+            raise ValueError(
+                "Incorrect value passed in 'engine' argument! Should be either 'scalar', 'vector', or 'numba'.")
 
-    def get_codes_ds(self):
+        if engine == 'numba' and njit is None:
+            warnings.warn("'numba' is not installed, falling back to the 'vector' engine.")
+            engine = 'vector'
+
+        self.engine = engine
+
+    def get_codes_ds(self, initials=None):
         ds = self.ds
         write_to = self.write_to
+        initials = initials or {}
 
         codes = ['ffmc', 'dmc', 'dc']
         codes_ds = xr.Dataset({'Wind_Speed_10m_Mean': ds.Wind_Speed_10m_Mean})
@@ -112,7 +273,8 @@ class CodesComputation(Computation):
             print('Started processing {} at: {}'.format(code.upper(), datetime.now().time()))
 
             start = time()
-            code_arr = self.get_code_arr(ds, code)
+            with telemetry.span(code):
+                code_arr = self.get_code_arr(ds, code, initials.get(code))
             code_da = xr.DataArray(data=code_arr,
                                    coords={'time': ds.time.values,
                                            'y': ds.y.values,
@@ -122,15 +284,16 @@ class CodesComputation(Computation):
             print('{} ready. {:.2f} min elapsed'.format(code.upper(), (end - start) / 60))
 
             codes_ds = codes_ds.assign({code.upper(): code_da})
+            self.state[code] = code_arr[-1]
 
         if write_to is not None:
-            codes_ds.to_netcdf(write_to)
+            with telemetry.span('write'):
+                encoding.to_netcdf(codes_ds, write_to, compact=self.compact)
 
         return codes_ds
 
     def get_code_arr(self, ds, code_name, initial_value=None):
         code_arr = []
-        initials = {'ffmc': 85, 'dmc': 6, 'dc': 15}
         variables = {'ffmc': ['Temperature_Air_2m_Mean_24h', 'Relative_Humidity_min', 'Wind_Speed_10m_Mean',
                               'Precipitation_Flux'],
                      'dmc': ['Temperature_Air_2m_Mean_24h', 'Relative_Humidity_min', 'Precipitation_Flux', 'Month'],
@@ -141,19 +304,26 @@ class CodesComputation(Computation):
         time_dim = len(ds.time)
         columns = len(variables[code_name])
 
-        if initial_value is not None:
-            initials[code_name] = initial_value
+        initial_value = self.get_initial(code_name, initial_value)
 
         da = ds[variables[code_name]].to_array().to_numpy()
+
+        if self.engine == 'vector':
+            return self.get_code_grid(da.astype(float), initial_value, code_name)
+        if self.engine == 'numba':
+            return self.get_code_jit(da.astype(float), initial_value, code_name)
+
         da = da.reshape(columns, time_dim, -1)
         da = np.swapaxes(da, 0, 2)
 
-        for arr in da:
+        initial_arr = np.broadcast_to(initial_value, (y, x)).reshape(-1)
+
+        for arr, initial in zip(da, initial_arr):
             if np.all(np.isnan(arr)):
                 code_arr.append(np.full([time_dim], np.nan))
             else:
                 code_arr.append(
-                    self.get_code_vec(arr, initials[code_name], code_name))
+                    self.get_code_vec(arr, initial, code_name))
 
         code_arr = np.array(code_arr).reshape((y, x, -1))
         code_arr = np.moveaxis(code_arr, 2, 0)
@@ -176,6 +346,46 @@ class CodesComputation(Computation):
 
         return code_vec[1:]
 
+    def get_code_grid(self, weather_array, initial_value, code_name):
+        compute = {'ffmc': self.compute_ffmc_arr,
+                   'dmc': self.compute_dmc_arr,
+                   'dc': self.compute_dc_arr}
+
+        if code_name not in compute:
+            raise NameError('Incorrect code name!')
+
+        code_arr = np.empty(weather_array.shape[1:])
+        code_value = np.full(weather_array.shape[2:], initial_value, dtype=float)
+        empty = np.all(np.isnan(weather_array), axis=(0, 1))
+
+        with np.errstate(all='ignore'):
+            for day in range(weather_array.shape[1]):
+                code_value = compute[code_name](*weather_array[:, day], code_value)
+                code_arr[day] = code_value
+
+        code_arr[:, empty] = np.nan
+
+        return code_arr
+
+    def get_code_jit(self, weather_array, initial_value, code_name):
+        if code_name not in ['ffmc', 'dmc', 'dc']:
+            raise NameError('Incorrect code name!')
+
+        columns, time_dim = weather_array.shape[:2]
+        shape = weather_array.shape[1:]
+
+        kernel = get_kernel(code_name)
+        weather_array = np.ascontiguousarray(weather_array.reshape(columns, time_dim, -1))
+        initial_arr = np.full(shape[1:], initial_value, dtype=float).reshape(-1)
+
+        code_arr = kernel(weather_array, initial_arr)
+        code_arr = code_arr.reshape(shape)
+
+        empty = np.all(np.isnan(weather_array), axis=(0, 1)).reshape(shape[1:])
+        code_arr[:, empty] = np.nan
+
+        return code_arr
+
     @staticmethod
     def compute_ffmc(t, h, w, p, ffmc0):
         """Compute FFMC (Fine Fuel Moisture Code) given yesterday's FFMC value 'ffmc0',
@@ -297,3 +507,147 @@ class CodesComputation(Computation):
             dc += dc0
 
         return dc
+
+    @staticmethod
+    def compute_ffmc_arr(t, h, w, p, ffmc0):
+        """Compute FFMC (Fine Fuel Moisture Code) over the whole grid at once given yesterday's
+         FFMC grid 'ffmc0', temperature, relative humidity, wind, and precipitation grids"""
+
+        mo = (147.2 * (101 - ffmc0)) / (59.5 + ffmc0)
+
+        rf = p - .5
+        mo_rain = mo + 42.5 * rf * np.exp(-100 / (251 - mo)) * (1 - np.exp(-6.93 / rf))
+        mo_rain = np.where(mo > 150,
+                           mo_rain + (.0015 * np.power(mo - 150, 2)) * np.sqrt(rf),
+                           mo_rain)
+        mo_rain = np.where(mo_rain > 250, 250, mo_rain)
+
+        mo = np.where(p > .5, mo_rain, mo)
+
+        ed = .942 * np.power(h, .679) \
+             + (11 * np.exp((h - 100) / 10)) \
+             + 0.18 * (21.1 - t) * (1 - 1 / np.exp(.1150 * h))
+
+        ew = .618 * np.power(h, .753) \
+             + (10 * np.exp((h - 100) / 10)) \
+             + .18 * (21.1 - t) * (1 - 1 / np.exp(.115 * h))
+
+        kl = .424 * (1 - np.power(h / 100, 1.7)) \
+             + (.0694 * np.sqrt(w)) * (1 - np.power(h / 100, 8))
+        kw = kl * (.581 * np.exp(.0365 * t))
+        m_dry = ed + (mo - ed) / np.power(10, kw)
+
+        kl = .424 * (1 - np.power((100 - h) / 100, 1.7)) \
+             + (.0694 * np.sqrt(w)) * (1 - np.power((100 - h) / 100, 8))
+        kw = kl * (.581 * np.exp(.0365 * t))
+        m_wet = ew - (ew - mo) / np.power(10, kw)
+
+        m = np.where(mo > ed, m_dry,
+                     np.where(mo < ew, m_wet, mo))
+
+        ffmc = (59.5 * (250 - m)) / (147.2 + m)
+
+        ffmc = np.where(ffmc > 101, 101, ffmc)
+        ffmc = np.where(ffmc < 0, 0, ffmc)
+
+        return ffmc
+
+    @staticmethod
+    def compute_dmc_arr(t, h, p, month, dmc0):
+        """Compute DMC (Duff Moisture Code) over the whole grid at once given yesterday's
+         DMC grid 'dmc0', temperature, relative humidity, precipitation, and month grids"""
+
+        dl = np.array([6.5, 7.5, 9, 12.8, 13.9, 13.9, 12.4, 10.9, 9.4, 8, 7, 6])
+
+        t = np.where(t < -1.1, -1.1, t)
+
+        rk = 1.894 * (t + 1.1) * (100 - h) * (dl[np.asarray(month, dtype=int) - 1] * 1e-4)
+
+        rw = .92 * p - 1.27
+        wmi = 20 + 280 / np.exp(.023 * dmc0)
+
+        b = np.where(dmc0 > 33,
+                     np.where(dmc0 > 65,
+                              6.2 * np.log(dmc0) - 17.2,
+                              14 - 1.3 * np.log(dmc0)),
+                     100 / (.5 + .3 * dmc0))
+
+        wmr = wmi + (1e3 * rw) / (48.77 + b * rw)
+        pr = np.where(p > 1.5, 43.43 * (5.6348 - np.log(wmr - 20)), dmc0)
+
+        pr = np.where(pr < 0, 0, pr)
+
+        dmc = pr + rk
+        dmc = np.where(dmc < 1, 1, dmc)
+
+        return dmc
+
+    @staticmethod
+    def compute_dc_arr(t, p, month, dc0):
+        """Compute DC (Drought Code) over the whole grid at once given yesterday's
+        DC grid 'dc0', temperature, precipitation, and month grids"""
+
+        fl = np.array([-1.6, -1.6, -1.6, .9, 3.8, 5.8, 6.4, 5.0, 2.4, .4, -1.6, -1.6])
+
+        t = np.where(t < -2.8, -2.8, t)
+
+        pe = (0.36 * (t + 2.8) + fl[np.asarray(month, dtype=int) - 1]) / 2
+        pe = np.where(pe < 0, 0, pe)
+
+        rw = .83 * p - 1.27
+        smi = 800 * np.exp(-dc0 / 400)
+        dr = dc0 - 400 * np.log(1 + ((3.937 * rw) / smi))
+
+        dc = np.where(p > 2.8,
+                      np.where(dr > 0, pe + dr, pe),
+                      pe + dc0)
+
+        return dc
+
+
+kernels = {}
+
+
+def get_kernel(code_name):
+    """Compile (once per process) a parallel per-pixel loop over the scalar code function"""
+
+    if code_name in kernels:
+        return kernels[code_name]
+
+    compute = {'ffmc': CodesComputation.compute_ffmc,
+               'dmc': CodesComputation.compute_dmc,
+               'dc': CodesComputation.compute_dc}
+
+    step = njit(compute[code_name])
+
+    if code_name == 'dc':
+        @njit(parallel=True)
+        def kernel(weather, initial):
+            code_arr = np.empty(weather.shape[1:])
+
+            for i in prange(weather.shape[2]):
+                value = initial[i]
+
+                for day in range(weather.shape[1]):
+                    value = step(weather[0, day, i], weather[1, day, i], weather[2, day, i], value)
+                    code_arr[day, i] = value
+
+            return code_arr
+    else:
+        @njit(parallel=True)
+        def kernel(weather, initial):
+            code_arr = np.empty(weather.shape[1:])
+
+            for i in prange(weather.shape[2]):
+                value = initial[i]
+
+                for day in range(weather.shape[1]):
+                    value = step(weather[0, day, i], weather[1, day, i], weather[2, day, i],
+                                 weather[3, day, i], value)
+                    code_arr[day, i] = value
+
+            return code_arr
+
+    kernels[code_name] = kernel
+
+    return kernel
@@ -0,0 +1,191 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from time import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from processing import telemetry
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, cache=True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.cache = cache
+
+
+class Graph:
+    def __init__(self, cache_dir=None, max_workers=2):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+
+        self.stages = {}
+        self.timings = {}
+        self.skipped = []
+
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+        if cache_dir is not None and os.path.exists(f'{cache_dir}/hashes.json'):
+            with open(f'{cache_dir}/hashes.json') as f:
+                self.hashes = json.load(f)
+
+    def add(self, name, func, inputs=(), outputs=(), params=None, cache=True):
+        self.stages[name] = Stage(name, func, inputs, outputs, params, cache)
+
+    def get_dependencies(self, stage):
+        """Get the stages producing any of the inputs of 'stage'"""
+
+        return {other.name for other in self.stages.values()
+                if other is not stage and set(other.outputs) & set(stage.inputs)}
+
+    def run(self):
+        """Run every stage once all of its dependencies are done, independent stages concurrently"""
+
+        dependencies = {name: self.get_dependencies(stage) for name, stage in self.stages.items()}
+
+        done = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(done) < len(self.stages):
+                for name, stage in self.stages.items():
+                    if name not in done and name not in running.values() and dependencies[name] <= done:
+                        running[executor.submit(self.run_stage, stage)] = name
+
+                if not running:
+                    raise ValueError(
+                        'Stages {} depend on each other!'.format(sorted(set(self.stages) - done)))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+
+        self.save_hashes()
+
+        return self.timings
+
+    def run_stage(self, stage):
+        start = time()
+
+        with telemetry.span(stage.name) as record:
+            if self.cache_dir is None or not stage.cache:
+                stage.func()
+                self.timings[stage.name] = time() - start
+                return
+
+            cache_path = f'{self.cache_dir}/{stage.name}/{self.get_key(stage)}'
+
+            if self.restore(stage, cache_path):
+                print(f'{stage.name} is up to date, skipping')
+                self.skipped.append(stage.name)
+                record['cached'] = True
+            else:
+                stage.func()
+                self.store(stage, cache_path)
+
+        self.timings[stage.name] = time() - start
+
+    def get_key(self, stage):
+        """Derive the cache key of a stage from its name, parameters, and the content of its inputs"""
+
+        key = {'stage': stage.name,
+               'params': stage.params,
+               'inputs': {path: self.hash_path(path) for path in stage.inputs}}
+
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def hash_path(self, path):
+        """Hash a file or every file of a directory, reusing hashes of files that did not change"""
+
+        if os.path.isdir(path):
+            digest = hashlib.blake2b()
+
+            for folder, _, files in sorted(os.walk(path)):
+                for file in sorted(files):
+                    file_path = f'{folder}/{file}'
+                    digest.update(os.path.relpath(file_path, path).encode())
+                    digest.update(self.hash_path(file_path).encode())
+
+            return digest.hexdigest()
+
+        if not os.path.exists(path):
+            return 'missing'
+
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+
+        with self.lock:
+            if path in self.hashes and self.hashes[path][0] == signature:
+                return self.hashes[path][1]
+
+        digest = hashlib.blake2b()
+
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+        with self.lock:
+            self.hashes[path] = [signature, digest.hexdigest()]
+
+        return digest.hexdigest()
+
+    def save_hashes(self):
+        if self.cache_dir is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with open(f'{self.cache_dir}/hashes.json', 'w') as f:
+            json.dump(self.hashes, f)
+
+    @staticmethod
+    def get_artifacts(stage, cache_path):
+        return [f'{cache_path}/{i}_{os.path.basename(output)}' for i, output in enumerate(stage.outputs)]
+
+    def store(self, stage, cache_path):
+        """Copy the outputs of a finished stage into the cache"""
+
+        os.makedirs(cache_path, exist_ok=True)
+
+        for output, artifact in zip(stage.outputs, self.get_artifacts(stage, cache_path)):
+            if os.path.isdir(output):
+                shutil.copytree(output, artifact, dirs_exist_ok=True)
+            elif os.path.exists(output):
+                shutil.copy2(output, artifact)
+
+        with open(f'{cache_path}/manifest.json', 'w') as f:
+            json.dump({'stage': stage.name, 'params': stage.params, 'outputs': stage.outputs}, f,
+                      default=str)
+
+    def restore(self, stage, cache_path):
+        """Put the cached outputs of a stage in place, returns False if there is no valid cache entry"""
+
+        artifacts = self.get_artifacts(stage, cache_path)
+
+        if not os.path.exists(f'{cache_path}/manifest.json'):
+            return False
+        if not all(os.path.exists(artifact) for artifact in artifacts):
+            return False
+
+        for output, artifact in zip(stage.outputs, artifacts):
+            if os.path.exists(output) and self.hash_path(output) == self.hash_path(artifact):
+                continue
+
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+
+            if os.path.isdir(artifact):
+                shutil.rmtree(output, ignore_errors=True)
+                shutil.copytree(artifact, output)
+            else:
+                shutil.copy2(artifact, output)
+
+        return True
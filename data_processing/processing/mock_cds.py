@@ -0,0 +1,134 @@
+import io
+import json
+import shutil
+import zipfile
+import threading
+import urllib.request
+
+from time import sleep, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockServer:
+    """Local stand-in for the CDS endpoint, answers every request with a zip of daily files
+    and fails the first attempts of each request to exercise retries"""
+
+    def __init__(self, delay=.1, failures=1, port=0):
+        self.delay = delay
+        self.failures = failures
+
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.active = 0
+        self.max_active = 0
+        self.served = 0
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.get_handler())
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def get_zip(dataset, request):
+        days = request.get('day', [f'{day:02d}' for day in range(1, 32)])
+        months = request.get('month', [f'{month:02d}' for month in range(1, 13)])
+
+        days = [days] if isinstance(days, str) else days
+        months = [months] if isinstance(months, str) else months
+
+        buffer = io.BytesIO()
+
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            for month in months:
+                for day in days:
+                    zf.writestr(f'{dataset}_{request["year"]}{month}{day}_final-v1.0.nc',
+                                json.dumps(request) * 100)
+
+        return buffer.getvalue()
+
+    def get_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                key = json.dumps(body, sort_keys=True)
+
+                with mock.lock:
+                    mock.attempts[key] = mock.attempts.get(key, 0) + 1
+                    attempt = mock.attempts[key]
+                    mock.active += 1
+                    mock.max_active = max(mock.max_active, mock.active)
+
+                try:
+                    sleep(mock.delay)
+
+                    if attempt <= mock.failures:
+                        self.send_error(503, 'Service busy')
+                        return
+
+                    data = mock.get_zip(body['dataset'], body['request'])
+
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/zip')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                    with mock.lock:
+                        mock.served += 1
+                finally:
+                    with mock.lock:
+                        mock.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class MockClient:
+    """Drop-in for 'cdsapi.Client' that retrieves from a 'MockServer'"""
+
+    def __init__(self, url):
+        self.url = url
+
+    def retrieve(self, dataset, request, target):
+        data = json.dumps({'dataset': dataset, 'request': request}).encode()
+        req = urllib.request.Request(f'{self.url}/retrieve', data=data,
+                                     headers={'Content-Type': 'application/json'})
+
+        with urllib.request.urlopen(req) as response, open(target, 'wb') as f:
+            shutil.copyfileobj(response, f, 1 << 20)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    from processing.downloads import DownloadManager
+
+    requests = [('sis-agrometeorological-indicators', {'year': 2021, 'month': '07', 'day': f'{day:02d}'}, side)
+                for day in range(1, 17) for side in ['east', 'west']]
+
+    with MockServer(delay=.2, failures=1) as server, tempfile.TemporaryDirectory() as folder:
+        manager = DownloadManager(client=MockClient(server.url), workers=8, backoff=1.1)
+        jobs = [(dataset, request, f'{folder}/{side}') for dataset, request, side in requests]
+
+        start = time()
+        manager.run(jobs)
+        print('{} requests in {:.2f} s, {} served, {} in flight at most'.format(
+            len(jobs), time() - start, server.served, server.max_active))
+
+        os.remove(f'{folder}/east/{sorted(os.listdir(f"{folder}/east"))[-1]}')
+
+        start = time()
+        manager.run(jobs)
+        print('Rerun after removing one file: {:.2f} s, {} served in total'.format(time() - start, server.served))
@@ -0,0 +1,212 @@
+import warnings
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from processing import telemetry
+from processing.fwi import FWI
+from processing.cds import APILoader
+from processing.graph import Graph
+from processing.fires import Fires
+from processing.forest import Forest
+from processing.weather import DataLoader
+from processing.dataset import Dataset
+
+
+class Pipeline:
+    stages = ['download', 'weather', 'fwi', 'forest', 'fires', 'combine']
+
+    def __init__(self, year, download=False, fwi=None, warm_start=False, forest=False, fires=False, update=None,
+                 cache=False, cleanup=True, lazy=False, backend='netcdf', chunks=None, compact=False, telemetry=None,
+                 profile=()):
+        self.year = year
+        self.download = download
+        self.fwi = fwi
+        self.warm_start = warm_start
+        self.forest = forest
+        self.fires = fires
+        self.update = update
+        self.lazy = lazy
+        self.backend = backend
+        self.chunks = chunks
+        self.compact = compact
+        self.telemetry = telemetry
+        self.profile = profile
+
+        self.root = '/Users/artembadmaev/IT/thesis'
+        self.cache = cache and not update
+        self.cleanup = cleanup and not self.cache
+
+        self.timings = {}
+
+    def run(self):
+        """Run the stages of one year: weather -> FWI -> forest and fires (concurrently) -> combine. With
+        'telemetry' the spans of every stage are appended to that JSON lines file"""
+
+        if self.telemetry is None:
+            return self.run_stages()
+
+        telemetry.start(self.telemetry, profile=self.profile, year=self.year)
+
+        try:
+            return self.run_stages()
+        finally:
+            telemetry.stop()
+
+    def run_stages(self):
+        year = self.year
+        dates = None
+        dataset = Dataset(year=year, region='rus', cleanup=self.cleanup, backend=self.backend, compact=self.compact)
+
+        if self.update:
+            dates = dataset.get_missing_dates(self.update)
+
+            if len(dates) == 0:
+                print(f'{year} is up to date')
+                return self.timings
+
+            print('Updating {} from {} to {}'.format(year, dates[0].date(), dates[-1].date()))
+
+        graph = self.get_graph(dataset, dates)
+        self.timings = graph.timings
+
+        return graph.run()
+
+    def get_graph(self, dataset, dates=None):
+        """Declare the inputs and outputs of every requested stage"""
+
+        year = self.year
+        temp = f'{self.root}/data/temp'
+        cleanup = self.cleanup
+        land_year = 2020 if year == 2021 else year
+
+        # cProfile can only profile one thread at a time, profiled stages run one after another
+        graph = Graph(cache_dir=f'{temp}/cache' if self.cache else None, max_workers=1 if self.profile else 2)
+
+        components = [f'{temp}/fwi/weather/weather_components/{component}/{side}/{year}'
+                      for component in ['wind', 'humidity', 'temperature', 'precipitation']
+                      for side in ['east', 'west']]
+
+        weather = f'{temp}/fwi/weather/{year}.nc'
+        fwi = f'{temp}/fwi/{year}.nc'
+        forest = f'{temp}/forest/{year}.nc'
+        fires = f'{temp}/fires/{year}.nc'
+
+        if self.download:
+            graph.add('download', lambda: self.get_raw_data(dates),
+                      outputs=components + [f'{temp}/forest/land/{year}.nc'],
+                      cache=False)
+
+        if self.fwi:
+            fwi_inputs = [weather]
+
+            if self.warm_start:
+                fwi_inputs.append(FWI.get_state_path(year - 1))
+
+            graph.add('weather', DataLoader(year, cleanup=cleanup, lazy=self.lazy, dates=dates).get_weather_ds,
+                      inputs=components, outputs=[weather], params={'lazy': self.lazy})
+            graph.add('fwi', lambda: FWI(year, cleanup=cleanup, compact=self.compact).get_fwi(
+                engine=self.fwi, warm_start=self.warm_start, update=dates is not None),
+                      inputs=fwi_inputs, outputs=[fwi, FWI.get_state_path(year)],
+                      params={'engine': self.fwi, 'warm_start': self.warm_start, 'compact': self.compact})
+
+        if self.forest:
+            graph.add('forest', Forest(year, cleanup=cleanup, compact=self.compact).get_forest,
+                      inputs=[fwi, f'{temp}/forest/land/{land_year}.nc'], outputs=[forest],
+                      params={'method': 'blocks', 'compact': self.compact})
+
+        if self.fires:
+            graph.add('fires', Fires(year, cleanup=cleanup, compact=self.compact).get_counts_ds,
+                      inputs=[fwi] + [f'{temp}/fires/viirs/{year}.{ext}' for ext in ['json', 'csv', 'parquet']],
+                      outputs=[fires], params={'compact': self.compact})
+
+        if self.backend == 'zarr':
+            output = f'{dataset.get_path()}/{year}'
+        else:
+            output = dataset.get_path()
+
+        graph.add('combine', lambda: dataset.combine(append=dates is not None, chunks=self.chunks),
+                  inputs=[fwi, forest, fires, f'{self.root}/data_processing/regions.json'],
+                  outputs=[output],
+                  params={'region': 'rus', 'backend': self.backend, 'chunks': self.chunks, 'compact': self.compact})
+
+        return graph
+
+    def get_raw_data(self, dates=None):
+        al = APILoader(self.year)
+        al.get_raw_weather(dates)
+
+        if dates is None:
+            al.get_land()
+
+
+def run_year(year, options):
+    """Run the pipeline of one year, returning the error instead of raising it"""
+
+    pipeline = Pipeline(year, **options)
+
+    try:
+        pipeline.run()
+    except Exception:
+        return year, pipeline.timings, traceback.format_exc()
+
+    return year, pipeline.timings, None
+
+
+def run_years(years, workers=None, **options):
+    """Run independent years across a process pool, a failed year does not stop the others. With 'warm_start'
+    every year starts from the state of the previous one, so the years run in order and stop at the first
+    failed one instead of silently starting the next year from the default codes"""
+
+    if options.get('warm_start') and workers != 1:
+        warnings.warn("'warm_start' makes every year depend on the previous one, running years one at a time.")
+        workers = 1
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if options.get('warm_start'):
+            failed = None
+
+            for year in sorted(years):
+                if failed is not None:
+                    results[year] = ({}, f'Skipped as {failed} failed and {year} would not start from its state.')
+                    print(f'{year} skipped')
+                    continue
+
+                year, timings, error = executor.submit(run_year, year, options).result()
+                results[year] = (timings, error)
+                print_result(year, timings, error)
+
+                if error is not None:
+                    failed = year
+        else:
+            futures = [executor.submit(run_year, year, options) for year in years]
+
+            for future in as_completed(futures):
+                year, timings, error = future.result()
+                results[year] = (timings, error)
+                print_result(year, timings, error)
+
+    return dict(sorted(results.items()))
+
+
+def print_result(year, timings, error):
+    if error is None:
+        print('{} ready. {:.2f} min elapsed'.format(year, sum(timings.values()) / 60))
+    else:
+        print(f'{year} failed:\n{error}')
+
+
+def print_summary(results):
+    """Print wall time in minutes of every stage of every year"""
+
+    stages = [stage for stage in Pipeline.stages
+              if any(stage in timings for timings, _ in results.values())]
+
+    print('{:<6}'.format('year') + ''.join('{:>10}'.format(stage) for stage in stages) + '{:>10}'.format('status'))
+
+    for year, (timings, error) in results.items():
+        row = ''.join('{:>10}'.format('{:.2f}'.format(timings[stage] / 60) if stage in timings else '-')
+                      for stage in stages)
+        print('{:<6}'.format(year) + row + '{:>10}'.format('ok' if error is None else 'failed'))
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import cProfile
+import resource
+import threading
+import pandas as pd
+
+from time import time, perf_counter, process_time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+recorder = None
+# since Python 3.12 only one profiler can be active in the process, profiled spans wait for each other
+profiling = threading.Lock()
+
+
+def get_rss():
+    """Resident memory of the process in bytes, the peak so far if neither psutil nor /proc is available"""
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def get_io():
+    """Bytes read and written by the process so far, including reads served from the page cache"""
+
+    if psutil is not None and hasattr(psutil.Process, 'io_counters'):
+        counters = psutil.Process().io_counters()
+        return getattr(counters, 'read_chars', counters.read_bytes), getattr(counters, 'write_chars',
+                                                                             counters.write_bytes)
+
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError):
+        return None, None
+
+
+class Recorder:
+    """Wall time, CPU time, peak RSS and I/O of nested spans, appended to 'path' as JSON lines.
+
+    Spans opened inside a span are named after it, e.g. 'fwi/codes/ffmc'. CPU time and I/O are counted for
+    the whole process, so they include the stages running concurrently. The peak RSS of a span is sampled
+    every 'interval' seconds. The top spans (stages) listed in 'profile', or all of them with True, are run
+    under 'profiler', a function of the output path returning a context manager, cProfile by default. The
+    cProfile spans of concurrent stages are serialized, their wall time includes the wait"""
+
+    def __init__(self, path, profile=(), profiler=None, interval=.05, **fields):
+        self.path = path
+        self.profile = profile
+        self.profiler = profiler or self.cprofile
+        self.interval = interval
+        self.fields = fields
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.peaks = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            rss = get_rss()
+
+            with self.lock:
+                for key, peak in self.peaks.items():
+                    self.peaks[key] = max(peak, rss)
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, **fields):
+        stack = self.get_stack()
+        stack.append(name)
+        full_name = '/'.join(stack)
+        key = object()
+
+        rss = get_rss()
+        with self.lock:
+            self.peaks[key] = rss
+
+        read, written = get_io()
+        start_time = time()
+        start, cpu = perf_counter(), process_time()
+        status = 'ok'
+        extra = dict(fields)
+
+        try:
+            with self.get_profiler(stack):
+                yield extra
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            wall, cpu = perf_counter() - start, process_time() - cpu
+            read_end, written_end = get_io()
+            rss = get_rss()
+
+            with self.lock:
+                peak = max(self.peaks.pop(key), rss)
+
+            stack.pop()
+
+            self.write({**self.fields,
+                        'span': full_name,
+                        'stage': full_name.split('/')[0],
+                        'start': start_time,
+                        'wall': wall,
+                        'cpu': cpu,
+                        'peak_rss': peak,
+                        'read': read_end - read if read is not None else None,
+                        'written': written_end - written if written is not None else None,
+                        'status': status,
+                        **extra})
+
+    def get_profiler(self, stack):
+        if len(stack) > 1 or not (self.profile is True or stack[0] in self.profile):
+            return nullcontext()
+
+        name = '_'.join(str(value) for value in self.fields.values())
+        path = '{}/{}{}.prof'.format(os.path.splitext(self.path)[0], f'{name}_' if name else '', stack[0])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        return self.profiler(path)
+
+    @staticmethod
+    @contextmanager
+    def cprofile(path):
+        with profiling:
+            profile = cProfile.Profile()
+            profile.enable()
+
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(path)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+
+        with self.lock, open(self.path, 'a') as f:
+            f.write(line)
+
+    def close(self):
+        self.stopped.set()
+        self.sampler.join()
+
+
+def start(path, **kwargs):
+    """Record the spans of this process to 'path' until 'stop' is called"""
+
+    global recorder
+
+    stop()
+    recorder = Recorder(path, **kwargs)
+
+    return recorder
+
+
+def stop():
+    global recorder
+
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+def span(name, **fields):
+    """Record a block of code as a span of the active recorder, does nothing if there is none. The block gets
+    a dict of extra fields of the record it can add to"""
+
+    if recorder is None:
+        return nullcontext({})
+
+    return recorder.span(name, **fields)
+
+
+def read(path):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(path, since=None):
+    """Total wall time, CPU time, I/O in MB and the highest peak RSS in MB of every span recorded in 'path',
+    only of the spans started after the 'since' timestamp if given"""
+
+    df = read(path)
+
+    if since is not None:
+        df = df[df.start >= since]
+    # stages in the order they started, every span after the span it is nested in
+    df['order'] = df.groupby('stage').start.transform('min')
+    df = df.sort_values(['order', 'start'])
+
+    for column in ['peak_rss', 'read', 'written']:
+        df[column] = df[column].astype(float) / 2**20
+
+    summary = df.groupby('span', sort=False).agg(calls=('wall', 'size'), wall=('wall', 'sum'), cpu=('cpu', 'sum'),
+                                                 peak_rss_mb=('peak_rss', 'max'), read_mb=('read', 'sum'),
+                                                 written_mb=('written', 'sum'),
+                                                 errors=('status', lambda status: (status != 'ok').sum()))
+
+    return summary
@@ -1,18 +1,41 @@
 import os
+import re
+import hashlib
 import numpy as np
 import xarray as xr
+import dask.array as dsa
+
+from functools import partial
 
 from utils import CustomCRS
-from rioxarray.merge import merge_datasets
+from processing import telemetry
+from rioxarray.merge import merge_arrays, merge_datasets
 
 
 class DataLoader:
-    def __init__(self, year):
+    indexes = {}
+
+    def __init__(self, year, cleanup=True, reproject='cached', lazy=False, chunk_days=8, dates=None):
         self.year = year
+        self.cleanup = cleanup
+        self.dates = dates
         self.crs = CustomCRS().get_crs()
         self.root = '/Users/artembadmaev/IT/thesis'
         self.hours = ['06', '09', '12', '15', '18']
 
+        if reproject not in ['cached', 'gdal']:
+            raise ValueError(
+                "Incorrect value passed in 'reproject' argument! Should be either 'cached' or 'gdal'.")
+
+        if lazy and reproject != 'cached':
+            raise ValueError(
+                "Lazy assembly is only available with reproject='cached'!")
+
+        self.reproject = reproject
+        self.lazy = lazy
+        self.chunk_days = chunk_days
+        self.processed = []
+
     def get_weather_ds(self):
         root = self.root
         year = self.year
@@ -22,7 +45,9 @@ class DataLoader:
         new_crs = self.crs
 
         for component in components:
-            weather = self.get_component(component)
+            with telemetry.span(component):
+                weather = self.get_component(component)
+
             weather = weather.rio.write_crs(new_crs)
             weather = weather.rio.set_spatial_dims(x_dim='x', y_dim='y')
 
@@ -35,7 +60,14 @@ class DataLoader:
             if 'grid_mapping' in ds[var].attrs.keys():
                 del ds[var].attrs['grid_mapping']
 
-        ds.to_netcdf(f'{root}/data/temp/fwi/weather/{year}.nc')
+        with telemetry.span('write'):
+            ds.to_netcdf(f'{root}/data/temp/fwi/weather/{year}.nc')
+
+        if self.cleanup:
+            for file in self.processed:
+                os.remove(file)
+
+            self.processed = []
 
         return ds
 
@@ -53,57 +85,228 @@ class DataLoader:
 
             for hour in hours:
                 datasets.append(
-                    self.merge_weather(path_east, path_west, new_crs, hour=hour))
+                    self.merge(path_east, path_west, new_crs, hour=hour))
 
             ds = xr.merge(datasets)
             variables = list(ds.data_vars)
 
-            arr = np.array([ds[variable].to_numpy() for variable in variables])
-            arr = arr.min(axis=0)
+            if self.lazy:
+                arr = xr.concat([ds[variable] for variable in variables], dim='hour')
+                arr = arr.min(dim='hour', skipna=False).data
+            else:
+                arr = np.array([ds[variable].to_numpy() for variable in variables])
+                arr = arr.min(axis=0)
 
             ds['Relative_Humidity_min'] = (['time', 'y', 'x'], arr)
             ds = ds.drop_vars(variables)
         else:
-            ds = self.merge_weather(path_east, path_west, new_crs)
+            ds = self.merge(path_east, path_west, new_crs)
 
-            if component == 'temperature':
-                ds.Temperature_Air_2m_Mean_24h.values = ds.Temperature_Air_2m_Mean_24h.values - 273.15
-            if component == 'wind':
-                ds.Wind_Speed_10m_Mean.values = ds.Wind_Speed_10m_Mean.values * 3.6
+            with xr.set_options(keep_attrs=True):
+                if component == 'temperature':
+                    ds['Temperature_Air_2m_Mean_24h'] = ds.Temperature_Air_2m_Mean_24h - 273.15
+                if component == 'wind':
+                    ds['Wind_Speed_10m_Mean'] = ds.Wind_Speed_10m_Mean * 3.6
 
         return ds
 
+    def merge(self, path_east, path_west, crs, hour=''):
+        if self.lazy:
+            return self.merge_weather_lazy(path_east, path_west, crs, hour=hour)
+        if self.reproject == 'cached':
+            return self.merge_weather_cached(path_east, path_west, crs, hour=hour)
+
+        return self.merge_weather(path_east, path_west, crs, hour=hour, cleanup=self.cleanup, dates=self.dates)
+
     @staticmethod
-    def merge_weather(path_east, path_west, crs, hour=''):
+    def get_files(path_east, path_west, hour='', dates=None):
+        """Get the daily files of both tiles, only the files of 'dates' if given, as the files of the days
+        processed before are kept on disk by the runs without cleanup"""
+
+        days = None if dates is None else {f'{date:%Y%m%d}' for date in dates}
+
+        def is_selected(file_name):
+            if not file_name.endswith('.nc'):
+                return False
+            if days is None:
+                return True
+
+            day = re.search(r'\d{8}', file_name)
+
+            return day is not None and day.group() in days
 
         files_east = [f'{path_east}/{hour}/{file_name}'
                       for file_name in np.sort(os.listdir(f'{path_east}/{hour}'))
-                      if file_name.endswith('.nc')]
+                      if is_selected(file_name)]
 
         files_west = [f'{path_west}/{hour}/{file_name}'
                       for file_name in np.sort(os.listdir(f'{path_west}/{hour}'))
-                      if file_name.endswith('.nc')]
+                      if is_selected(file_name)]
+
+        return files_east, files_west
+
+    @staticmethod
+    def merge_weather(path_east, path_west, crs, hour='', cleanup=True, dates=None):
+        files_east, files_west = DataLoader.get_files(path_east, path_west, hour, dates)
 
         data = []
         files = list(zip(files_east, files_west))
 
         for file in files:
-            east = xr.open_dataset(file[0])
-            east = east.rio.write_crs(4326)
-            east = east.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-            east = east.rio.reproject(crs)
+            with telemetry.span('open'):
+                east = xr.open_dataset(file[0]).load()
+                west = xr.open_dataset(file[1]).load()
+
+            with telemetry.span('reproject'):
+                east = east.rio.write_crs(4326)
+                east = east.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
+                east = east.rio.reproject(crs)
 
-            west = xr.open_dataset(file[1])
-            west = west.rio.write_crs(4326)
-            west = west.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-            west = west.rio.reproject(crs)
+                west = west.rio.write_crs(4326)
+                west = west.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
+                west = west.rio.reproject(crs)
 
-            ew = merge_datasets([east, west])
+                ew = merge_datasets([east, west])
             data.append(ew)
 
-            os.remove(file[0])
-            os.remove(file[1])
+            if cleanup:
+                os.remove(file[0])
+                os.remove(file[1])
 
         ds = xr.concat(data, dim='time')
 
         return ds
+
+    def merge_weather_cached(self, path_east, path_west, crs, hour=''):
+        """Same as 'merge_weather', but the reprojection of the east and west grids is computed once
+        as source pixel indexes and applied to all days at once"""
+
+        files_east, files_west = self.get_files(path_east, path_west, hour, self.dates)
+
+        with telemetry.span('open'):
+            east = xr.concat([xr.open_dataset(file) for file in files_east], dim='time').load()
+            west = xr.concat([xr.open_dataset(file) for file in files_west], dim='time').load()
+
+        with telemetry.span('indexes'):
+            idx_east, idx_west, y, x = self.get_indexes(east, west, crs)
+
+        ds = xr.Dataset(coords={'time': east.time.values, 'y': y, 'x': x})
+
+        for var in list(east.data_vars):
+            with telemetry.span('reproject'):
+                arr_east = self.take(east[var].to_numpy(), idx_east)
+                arr_west = self.take(west[var].to_numpy(), idx_west)
+
+            ds[var] = (['time', 'y', 'x'], np.where(np.isnan(arr_east), arr_west, arr_east))
+            ds[var].attrs = east[var].attrs
+
+        if self.cleanup:
+            for file in files_east + files_west:
+                os.remove(file)
+
+        return ds
+
+    def merge_weather_lazy(self, path_east, path_west, crs, hour=''):
+        """Same as 'merge_weather_cached', but the daily files are opened as one chunked dataset and
+        merged chunk by chunk in parallel when the result is written, the files are removed afterwards"""
+
+        files_east, files_west = self.get_files(path_east, path_west, hour, self.dates)
+        chunks = {'time': self.chunk_days, 'lat': -1, 'lon': -1}
+
+        # every file holds one day, so the days are grouped into chunks of 'chunk_days' after opening
+        east = xr.open_mfdataset(files_east, combine='nested', concat_dim='time', chunks=chunks,
+                                 parallel=True).chunk(chunks)
+        west = xr.open_mfdataset(files_west, combine='nested', concat_dim='time', chunks=chunks,
+                                 parallel=True).chunk(chunks)
+
+        idx_east, idx_west, y, x = self.get_indexes(east, west, crs)
+
+        ds = xr.Dataset(coords={'time': east.time.values, 'y': y, 'x': x})
+
+        for var in list(east.data_vars):
+            arr_east = east[var].data
+            arr_west = west[var].data.rechunk({0: arr_east.chunks[0], 1: -1, 2: -1})
+
+            arr = dsa.map_blocks(partial(self.merge_blocks, idx_east=idx_east, idx_west=idx_west),
+                                 arr_east, arr_west,
+                                 chunks=(arr_east.chunks[0], (len(y),), (len(x),)),
+                                 dtype=np.promote_types(arr_east.dtype, 'float32'))
+
+            ds[var] = (['time', 'y', 'x'], arr)
+            ds[var].attrs = east[var].attrs
+
+        self.processed.extend(files_east + files_west)
+
+        return ds
+
+    @staticmethod
+    def merge_blocks(arr_east, arr_west, idx_east, idx_west):
+        arr_east = DataLoader.take(arr_east, idx_east)
+        arr_west = DataLoader.take(arr_west, idx_west)
+
+        return np.where(np.isnan(arr_east), arr_west, arr_east)
+
+    @staticmethod
+    def take(arr, idx):
+        """Pick source pixels 'idx' for every day of a (time, lat, lon) array, -1 meaning no pixel"""
+
+        arr = arr.reshape(arr.shape[0], -1)[:, np.where(idx < 0, 0, idx)]
+        arr = arr.astype(np.promote_types(arr.dtype, 'float32'))
+        arr[:, idx < 0] = np.nan
+
+        return arr
+
+    def get_indexes(self, east, west, crs):
+        """Get the source pixel of every target pixel for both grids, cached in memory and on disk
+        by grid geometry"""
+
+        key = hashlib.sha256()
+
+        for grid in [east, west]:
+            key.update(grid.lat.to_numpy().tobytes())
+            key.update(grid.lon.to_numpy().tobytes())
+
+        key.update(crs.to_wkt().encode())
+        key = key.hexdigest()[:16]
+
+        path = f'{self.root}/data/temp/fwi/weather/indexes/{key}.npz'
+
+        if key not in self.indexes:
+            if os.path.exists(path):
+                with np.load(path) as f:
+                    self.indexes[key] = (f['east'], f['west'], f['y'], f['x'])
+            else:
+                self.indexes[key] = self.compute_indexes(east, west, crs)
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.savez(path, east=self.indexes[key][0], west=self.indexes[key][1],
+                         y=self.indexes[key][2], x=self.indexes[key][3])
+
+        return self.indexes[key]
+
+    @staticmethod
+    def compute_indexes(east, west, crs):
+        """Reproject rasters holding their own flat pixel index with the same nearest resampling
+        as 'merge_weather', so the result tells which source pixel ends up where"""
+
+        reprojected = []
+
+        for grid in [east, west]:
+            da = xr.DataArray(
+                data=np.arange(len(grid.lat) * len(grid.lon), dtype='float64').reshape(len(grid.lat), -1),
+                coords={'lat': grid.lat.values, 'lon': grid.lon.values})
+            da = da.rio.write_crs(4326)
+            da = da.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
+            da = da.rio.write_nodata(-1)
+            da = da.rio.reproject(crs)
+
+            reprojected.append(da)
+
+        idx_east, idx_west = reprojected
+        blank_east, blank_west = [da.where(False, -1).rio.write_nodata(-1) for da in reprojected]
+
+        idx_east = merge_arrays([idx_east, blank_west])
+        idx_west = merge_arrays([blank_east, idx_west])
+
+        return (idx_east.to_numpy().astype('int64'), idx_west.to_numpy().astype('int64'),
+                idx_east.y.to_numpy(), idx_east.x.to_numpy())
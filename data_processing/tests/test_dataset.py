@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import rioxarray  # noqa: F401, the rio accessor
+
+from processing.dataset import Dataset
+from benchmarks.synthetic import get_grid, get_weather, get_regions
+
+
+def test_masks_are_cached_across_regions(tmp_path):
+    regions = get_regions()
+    regions.to_file(tmp_path / 'regions.json', driver='GeoJSON')
+
+    ds = get_weather(get_grid(step=1., days=2))[['Wind_Speed_10m_Mean']]
+    masks = tmp_path / 'data/temp/masks'
+
+    def clip_regions():
+        dataset = Dataset()
+        dataset.root = tmp_path
+        dataset.geo_path = tmp_path / 'regions.json'
+        Dataset.rasters.clear()
+
+        return dataset.clip_regions(ds, ['rus', 'sib', 'bur'])
+
+    first = clip_regions()
+    files = sorted(os.listdir(masks))
+
+    # a new process reads every mask from disk instead of rasterizing it again
+    second = clip_regions()
+
+    assert len(files) == 3
+    assert sorted(os.listdir(masks)) == files
+    for region in first:
+        np.testing.assert_array_equal(first[region].Wind_Speed_10m_Mean, second[region].Wind_Speed_10m_Mean)
@@ -0,0 +1,21 @@
+import numpy as np
+import rioxarray  # noqa: F401, the rio accessor
+
+from processing.forest import Forest
+from benchmarks.synthetic import get_grid, get_land
+
+
+def test_blocks_match_warp_across_antimeridian():
+    forest = Forest(2021)
+    da = get_land(step=1 / 20, extent=(-180, 180, 40, 83))
+    match_da = get_grid(step=.5, days=1).isel(time=0).rio.write_crs(forest.crs)
+
+    blocks = forest.aggregate_forest(da, match_da)
+    warp = forest.warp_forest(da, match_da)
+
+    # the cells east of x=162 are filled by the pixels west of the antimeridian
+    east = match_da.x > 162
+
+    assert (blocks.sel(x=east) > 0).any()
+    np.testing.assert_allclose(blocks.sel(x=east), warp.sel(x=east), atol=.02)
+    np.testing.assert_allclose(blocks, warp, atol=.02)
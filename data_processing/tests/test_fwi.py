@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from processing.fwi import CodesComputation, njit
+
+
+initials = {'ffmc': 85, 'dmc': 6, 'dc': 15}
+
+variables = {'ffmc': ['Temperature_Air_2m_Mean_24h', 'Relative_Humidity_min', 'Wind_Speed_10m_Mean',
+                      'Precipitation_Flux'],
+             'dmc': ['Temperature_Air_2m_Mean_24h', 'Relative_Humidity_min', 'Precipitation_Flux', 'Month'],
+             'dc': ['Temperature_Air_2m_Mean_24h', 'Precipitation_Flux', 'Month']}
+
+compute = {'ffmc': CodesComputation.compute_ffmc,
+           'dmc': CodesComputation.compute_dmc,
+           'dc': CodesComputation.compute_dc}
+
+
+@pytest.fixture(scope='module')
+def weather_path(tmp_path_factory):
+    """Random summer weather on a small grid, a tenth of the pixels missing as over the sea"""
+
+    rng = np.random.default_rng(0)
+    time = pd.date_range('2021-04-01', periods=60)
+    shape = (len(time), 20, 30)
+    land = rng.random(shape[1:]) < .9
+
+    weather = {'Temperature_Air_2m_Mean_24h': rng.normal(15, 8, shape),
+               'Relative_Humidity_min': np.clip(rng.normal(45, 15, shape), 5, 100),
+               'Wind_Speed_10m_Mean': rng.gamma(2, 6, shape),
+               'Precipitation_Flux': np.where(rng.random(shape) < .3, rng.gamma(1, 5, shape), 0)}
+
+    ds = xr.Dataset({var: (['time', 'y', 'x'], np.where(land, arr, np.nan)) for var, arr in weather.items()},
+                    coords={'time': time, 'y': np.arange(83, 63, -1.), 'x': np.arange(30.)})
+    ds['Month'] = (['time'], time.month.to_numpy())
+
+    path = tmp_path_factory.mktemp('fwi') / 'weather.nc'
+    ds.to_netcdf(path)
+
+    return path
+
+
+def get_loop(weather_array, initial_value, code_name):
+    """Reference codes, the scalar functions looped over every pixel and day"""
+
+    code_arr = np.full(weather_array.shape[1:], np.nan)
+
+    for i, j in np.ndindex(weather_array.shape[2:]):
+        if np.all(np.isnan(weather_array[:, :, i, j])):
+            continue
+
+        value = initial_value
+
+        for day in range(weather_array.shape[1]):
+            value = compute[code_name](*weather_array[:, day, i, j], value)
+            code_arr[day, i, j] = value
+
+    return code_arr
+
+
+@pytest.mark.parametrize('code_name', ['ffmc', 'dmc', 'dc'])
+@pytest.mark.parametrize('engine', ['vector', 'numba'])
+def test_engines_match_scalar(weather_path, engine, code_name):
+    if engine == 'numba' and njit is None:
+        pytest.skip("'numba' is not installed")
+
+    computation = CodesComputation(weather_path, None, engine=engine)
+    weather_array = computation.ds[variables[code_name]].to_array().to_numpy().astype(float)
+
+    if engine == 'vector':
+        code_arr = computation.get_code_grid(weather_array, initials[code_name], code_name)
+    else:
+        code_arr = computation.get_code_jit(weather_array, initials[code_name], code_name)
+
+    np.testing.assert_allclose(code_arr, get_loop(weather_array, initials[code_name], code_name),
+                               rtol=1e-10, atol=1e-10)
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from processing.weather import DataLoader
+
+
+variables = {'wind': 'Wind_Speed_10m_Mean',
+             'temperature': 'Temperature_Air_2m_Mean_24h',
+             'precipitation': 'Precipitation_Flux'}
+
+
+def write_days(root, dates, step=.5, seed=0):
+    """Daily AgERA5-like east and west files of every component, laid out as downloaded for 2021"""
+
+    rng = np.random.default_rng(seed)
+    lat = np.round(np.arange(83, 40, -step), 2)
+    tiles = {'east': np.round(np.arange(18, 180, step), 2), 'west': np.round(np.arange(-180, -168, step), 2)}
+
+    files = [(component, '', var) for component, var in variables.items()]
+    files += [('humidity', hour, f'Relative_Humidity_2m_{hour}h') for hour in ['06', '09', '12', '15', '18']]
+
+    for component, hour, var in files:
+        for side, lon in tiles.items():
+            folder = f'{root}/data/temp/fwi/weather/weather_components/{component}/{side}/2021/{hour}'
+            os.makedirs(folder, exist_ok=True)
+
+            for date in dates:
+                ds = xr.Dataset({var: (['time', 'lat', 'lon'], rng.gamma(2, 2, (1, len(lat), len(lon))))},
+                                coords={'time': [date], 'lat': lat, 'lon': lon})
+                ds.to_netcdf(f'{folder}/{var}_C3S-glob-agric_AgERA5_{date:%Y%m%d}_final-v1.0.nc')
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True}])
+def test_update_after_kept_inputs(tmp_path, options):
+    # a cached run keeps the daily files of the days it processed
+    loader = DataLoader(2021, cleanup=False, **options)
+    loader.root = tmp_path
+
+    write_days(tmp_path, pd.date_range('2021-07-01', periods=3))
+    assert len(loader.get_weather_ds().time) == 3
+
+    # the update merges only the new days
+    dates = pd.date_range('2021-07-04', periods=2)
+    write_days(tmp_path, dates, seed=1)
+
+    loader = DataLoader(2021, cleanup=False, dates=dates, **options)
+    loader.root = tmp_path
+
+    loader.get_weather_ds()
+
+    with xr.open_dataset(f'{tmp_path}/data/temp/fwi/weather/2021.nc') as ds:
+        np.testing.assert_array_equal(ds.time, dates)
+        assert ds.Relative_Humidity_min.notnull().any()
+
+
+def test_lazy_merge_chunks_days(tmp_path):
+    loader = DataLoader(2021, lazy=True, chunk_days=4)
+    loader.root = tmp_path
+
+    write_days(tmp_path, pd.date_range('2021-07-01', periods=10))
+    folder = f'{tmp_path}/data/temp/fwi/weather/weather_components/wind'
+    ds = loader.merge(f'{folder}/east/2021', f'{folder}/west/2021', loader.crs)
+
+    assert ds.Wind_Speed_10m_Mean.chunks[0] == (4, 4, 2)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+import pymc as pm
+
+
+def get_table(X1, X2, y, bins=(256, 128)):
+    """Aggregate rows into (binned FWI, binned forest_cover) -> (successes, trials).
+
+    FWI bins are quantiles of the rows, so they are fine where most of the rows are, forest_cover bins are
+    uniform over [0, 1]. Every bin is represented by the mean covariates of its rows, which keeps the
+    likelihood close to the one of the rows while its size is bounded by the number of bins"""
+
+    fwi_edges = np.unique(np.quantile(X1, np.linspace(0, 1, bins[0] + 1)[1:-1]))
+    forest_edges = np.linspace(0, 1, bins[1] + 1)[1:-1]
+
+    index = np.searchsorted(fwi_edges, X1) * bins[1] + np.searchsorted(forest_edges, X2)
+    size = (len(fwi_edges) + 1) * bins[1]
+
+    trials = np.bincount(index, minlength=size)
+    filled = trials > 0
+
+    table = pd.DataFrame({'X1': np.bincount(index, weights=X1, minlength=size)[filled] / trials[filled],
+                          'X2': np.bincount(index, weights=X2, minlength=size)[filled] / trials[filled],
+                          'successes': np.bincount(index, weights=y, minlength=size)[filled].astype(np.int64),
+                          'trials': trials[filled]})
+
+    return table
+
+
+def subsample(X1, X2, y, rate=.05, random_seed=None):
+    """Case-control sample: every row with a fire and a 'rate' share of the rows without. For the logit the
+    sampling only shifts the intercept, 'get_binomial_model' corrects it with an offset of -log(rate)"""
+
+    rng = np.random.default_rng(random_seed)
+    keep = (y > 0) | (rng.random(len(y)) < rate)
+
+    return X1[keep], X2[keep], y[keep]
+
+
+def get_binomial_model(X1, X2, successes, trials, rate=1.):
+    """Binomial version of the logit GLM over aggregated rows, with the priors of the Bernoulli model.
+    'rate' is the share of rows without fires kept by 'subsample'"""
+
+    offset = -np.log(rate)
+
+    with pm.Model() as model:
+        beta0 = pm.Normal('beta0', mu=-10, sigma=5)
+        beta1 = pm.Normal('beta1', mu=0, sigma=1)
+        beta2 = pm.Normal('beta2', mu=2, sigma=5)
+        p = pm.invlogit(beta0 + offset + beta1 * X1 + beta2 * X2)
+
+        pm.Binomial('pred', n=trials, p=p, observed=successes)
+
+    return model
+
+
+def fit_binomial(table, rate=1., draws=5000, random_seed=None):
+    from pymc.sampling.jax import sample_numpyro_nuts
+
+    with get_binomial_model(table.X1.values, table.X2.values, table.successes.values, table.trials.values, rate):
+        return sample_numpyro_nuts(chains=1, draws=draws, random_seed=random_seed, progressbar=False)
@@ -0,0 +1,135 @@
+from time import perf_counter
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import pymc as pm
+import arviz as az
+
+from aggregation import get_table, subsample, fit_binomial
+
+
+RANDOM_SEED = 5434
+
+
+def get_rows(paths, months=(5, 10), chunk=16):
+    """Read the valid rows of the combined files into compact X1, X2, y arrays, a few days at a time, without
+    the row-per-cell dataframe of the notebooks, which does not fit in memory for the 'rus' region"""
+
+    X1, X2, y = [], [], []
+
+    for path in paths:
+        with xr.open_dataset(path) as ds:
+            ds = ds.sel(time=ds.time.dt.month.isin(list(range(months[0], months[1] + 1))))
+            forest = ds.forest_cover.transpose('y', 'x').to_numpy().astype(np.float32)
+
+            for start in range(0, ds.sizes['time'], chunk):
+                days = ds.isel(time=slice(start, start + chunk))
+                fwi = days.FWI.transpose('time', 'y', 'x').to_numpy().astype(np.float32)
+                counts = days.counts.transpose('time', 'y', 'x').to_numpy()
+                cover = np.broadcast_to(forest, fwi.shape)
+
+                valid = np.isfinite(fwi) & np.isfinite(cover) & np.isfinite(counts)
+
+                X1.append(fwi[valid])
+                X2.append(cover[valid])
+                y.append((counts[valid] > 0).astype(np.int8))
+
+    return np.concatenate(X1), np.concatenate(X2), np.concatenate(y)
+
+
+def get_model(X1, X2, y, total_size=None):
+    """The Bernoulli logit of the notebooks, with 'total_size' the likelihood of a minibatch is scaled
+    to the whole dataset"""
+
+    with pm.Model() as model:
+        beta0 = pm.Normal('beta0', mu=-10, sigma=5)
+        beta1 = pm.Normal('beta1', mu=0, sigma=1)
+        beta2 = pm.Normal('beta2', mu=2, sigma=5)
+        p = pm.invlogit(beta0 + beta1 * X1 + beta2 * X2)
+
+        pm.Bernoulli('pred', p=p, observed=y, total_size=total_size)
+
+    return model
+
+
+def fit_nuts(X1, X2, y, draws=5000, random_seed=RANDOM_SEED):
+    """Full-batch NUTS as in 'model_logit.ipynb'"""
+
+    from pymc.sampling.jax import sample_numpyro_nuts
+
+    with get_model(X1, X2, y):
+        return sample_numpyro_nuts(chains=1, draws=draws, random_seed=random_seed, progressbar=False)
+
+
+def fit_advi(X1, X2, y, batch_size=10_000, n=30_000, draws=5000, learning_rate=.01, random_seed=RANDOM_SEED):
+    """Minibatch ADVI, every step evaluates the likelihood on 'batch_size' random rows only, so the cost of a step
+    does not grow with the number of rows. Returns draws of the fitted mean-field approximation in the same
+    InferenceData layout as NUTS"""
+
+    X1_batch, X2_batch, y_batch = pm.Minibatch(X1, X2, y.astype(np.int32), batch_size=batch_size)
+
+    with get_model(X1_batch, X2_batch, y_batch, total_size=len(y)):
+        approx = pm.fit(n=n, method='advi', obj_optimizer=pm.adam(learning_rate=learning_rate),
+                        callbacks=[pm.callbacks.CheckParametersConvergence(diff='absolute', tolerance=1e-3)],
+                        random_seed=random_seed, progressbar=False)
+
+    return approx.sample(draws, random_seed=random_seed)
+
+
+def compare(fits):
+    """Posterior mean and sd of every coefficient and the wall time of every '{name: (idata, seconds)}' fit"""
+
+    rows = []
+
+    for name, (idata, seconds) in fits.items():
+        summary = az.summary(idata, var_names=['beta0', 'beta1', 'beta2'], kind='stats')
+
+        for var, stats in summary.iterrows():
+            rows.append({'method': name, 'var': var, 'mean': stats['mean'], 'sd': stats['sd'], 'seconds': seconds})
+
+    return pd.DataFrame(rows).pivot(index='var', columns='method', values=['mean', 'sd', 'seconds'])
+
+
+def run(paths, methods=('advi', 'nuts'), draws=5000, rate=.05, **kwargs):
+    X1, X2, y = get_rows(paths)
+    print('{:,} rows, {:,} with fires'.format(len(y), int(y.sum())))
+
+    fits = {}
+
+    for method in methods:
+        start = perf_counter()
+        if method == 'advi':
+            idata = fit_advi(X1, X2, y, draws=draws, **kwargs)
+        elif method == 'binomial':
+            idata = fit_binomial(get_table(X1, X2, y), draws=draws, random_seed=RANDOM_SEED)
+        elif method == 'case-control':
+            table = get_table(*subsample(X1, X2, y, rate=rate, random_seed=RANDOM_SEED))
+            idata = fit_binomial(table, rate=rate, draws=draws, random_seed=RANDOM_SEED)
+        else:
+            idata = fit_nuts(X1, X2, y, draws=draws)
+        fits[method] = (idata, perf_counter() - start)
+
+    return fits
+
+
+parser = ArgumentParser(description='Fit the logit GLM in several ways and compare the posteriors')
+parser.add_argument('--region', default='crop', help="folder of the combined '{year}.nc' files")
+parser.add_argument('--years', default='2017-2020', metavar='START-END')
+parser.add_argument('--methods', nargs='+', default=['advi', 'nuts'],
+                    choices=['advi', 'nuts', 'binomial', 'case-control'])
+parser.add_argument('--draws', type=int, default=5000)
+parser.add_argument('--batch-size', type=int, default=10_000)
+parser.add_argument('-n', type=int, default=30_000, help='ADVI iterations')
+parser.add_argument('--rate', type=float, default=.05, help='share of rows without fires kept for case-control')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    start, _, end = args.years.partition('-')
+
+    fits = run([f'{args.region}/{year}.nc' for year in range(int(start), int(end or start) + 1)],
+               methods=args.methods, draws=args.draws, rate=args.rate, batch_size=args.batch_size, n=args.n)
+
+    print(compare(fits).round(4))
@@ -0,0 +1,92 @@
+import numpy as np
+import xarray as xr
+
+from scipy.special import expit
+
+
+def get_draws(idata, thin=1):
+    """Flatten the chains of the saved posterior into 1D arrays of 'beta0', 'beta1', and 'beta2'"""
+
+    posterior = idata.posterior.sel(draw=slice(None, None, thin))
+
+    return {name: posterior[name].to_numpy().reshape(-1) for name in ['beta0', 'beta1', 'beta2']}
+
+
+def hdi(samples, hdi_prob=.95):
+    """Highest density interval of every column of (draws, n) 'samples', the same interval as 'az.hdi'"""
+
+    n = samples.shape[0]
+    samples = np.sort(samples, axis=0)
+
+    interval_idx_inc = int(np.floor(hdi_prob * n))
+    n_intervals = n - interval_idx_inc
+    interval_width = samples[interval_idx_inc:] - samples[:n_intervals]
+
+    min_idx = np.argmin(interval_width, axis=0)
+    columns = np.arange(samples.shape[1])
+
+    return samples[min_idx, columns], samples[min_idx + interval_idx_inc, columns]
+
+
+def score(ds, draws, hdi_prob=.95, max_size=2**24, predictive=False, random_seed=None):
+    """Posterior fire probability of every cell of 'ds' and expected number of active cells of every day.
+
+    Probabilities are 'invlogit(beta0 + beta1 * FWI + beta2 * forest_cover)' evaluated for all draws at once as a
+    (draws, cells) matrix, the days are processed in chunks so the matrix has at most 'max_size' elements.
+    With 'predictive' the daily totals are sums of Bernoulli outcomes like 'pm.sample_posterior_predictive'
+    gives, otherwise they are sums of probabilities"""
+
+    rng = np.random.default_rng(random_seed)
+
+    beta0, beta1, beta2 = (draws[name][:, np.newaxis] for name in ['beta0', 'beta1', 'beta2'])
+    n_draws = len(beta0)
+
+    fwi = ds.FWI.transpose('time', 'y', 'x')
+    forest = ds.forest_cover
+    if 'time' not in forest.dims:
+        forest = forest.broadcast_like(fwi)
+    forest = forest.transpose('time', 'y', 'x')
+
+    n_time = fwi.shape[0]
+    n_cells = fwi.shape[1] * fwi.shape[2]
+    chunk = max(max_size // (n_draws * n_cells), 1)
+    block = max(max_size // (n_draws * chunk), 1)
+
+    pred = np.full((n_time, n_cells), np.nan)
+    lower = np.full((n_time, n_cells), np.nan)
+    higher = np.full((n_time, n_cells), np.nan)
+    totals = np.zeros((n_draws, n_time))
+
+    for start in range(0, n_time, chunk):
+        stop = min(start + chunk, n_time)
+
+        x1 = fwi[start:stop].to_numpy().reshape(-1)
+        x2 = forest[start:stop].to_numpy().reshape(-1)
+        days = np.repeat(np.arange(start, stop), n_cells)
+        cells = np.flatnonzero(np.isfinite(x1) & np.isfinite(x2))
+
+        for i in range(0, len(cells), block):
+            idx = cells[i:i + block]
+            p = expit(beta0 + beta1 * x1[idx] + beta2 * x2[idx])
+
+            rows, cols = days[idx], idx % n_cells
+            pred[rows, cols] = p.mean(axis=0)
+            lower[rows, cols], higher[rows, cols] = hdi(p, hdi_prob)
+
+            if predictive:
+                p = (rng.random(p.shape) < p).astype(p.dtype)
+
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            totals[:, rows[starts]] += np.add.reduceat(p, starts, axis=1)
+
+    total_lower, total_higher = hdi(totals, hdi_prob)
+    shape = fwi.shape
+
+    return xr.Dataset({'pred': (fwi.dims, pred.reshape(shape)),
+                       'pred_lower': (fwi.dims, lower.reshape(shape)),
+                       'pred_higher': (fwi.dims, higher.reshape(shape)),
+                       'total': ('time', totals.mean(axis=0)),
+                       'total_lower': ('time', total_lower),
+                       'total_higher': ('time', total_higher)},
+                      coords={'time': fwi.time, 'y': fwi.y, 'x': fwi.x},
+                      attrs={'hdi_prob': hdi_prob, 'draws': n_draws})
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import resource
+import tempfile
+import multiprocessing
+
+from time import perf_counter
+from argparse import ArgumentParser
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from unet import UNET, load_model, fit_epoch, predict_batch
+from dataset import GeoDataset
+
+
+configs = [('float64', False), ('float32', False), ('float32', True), ('bfloat16', False), ('bfloat16', True)]
+
+
+def get_dataset(args, years):
+    if args.synthetic:
+        generator = torch.Generator().manual_seed(years[0])
+        data = torch.randn(args.samples, 2, args.size, args.size, generator=generator)
+        mask = (torch.rand(args.samples, 1, args.size, args.size, generator=generator) < .02).float()
+        return TensorDataset(data, mask)
+
+    return GeoDataset(region=args.region, years=years, path=args.store)
+
+
+def get_peak_rss():
+    """Peak resident memory of the process in MB, 'ru_maxrss' is in bytes on macOS and in KB on Linux"""
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def run_config(args, precision, channels_last, weights):
+    """Time inference and training of one configuration, run in a fresh process so the peak RSS is its own"""
+
+    torch.set_num_threads(args.threads)
+
+    model = load_model(weights, precision=precision, channels_last=channels_last)
+
+    test = DataLoader(get_dataset(args, [args.test_year]), batch_size=args.batch_size)
+    preds = []
+
+    start = perf_counter()
+    for data, _ in test:
+        preds.append(predict_batch(model, data))
+    inference = sum(len(pred) for pred in preds) / (perf_counter() - start)
+
+    train = DataLoader(get_dataset(args, list(range(args.test_year - 3, args.test_year))),
+                       batch_size=args.batch_size, shuffle=True, drop_last=True)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+
+    start = perf_counter()
+    fit_epoch(model, train, nn.BCELoss(), optimizer)
+    training = len(train) * args.batch_size / (perf_counter() - start)
+
+    return {'precision': precision,
+            'channels_last': channels_last,
+            'inference': inference,
+            'training': training,
+            'peak_rss': get_peak_rss(),
+            'preds': torch.cat(preds).numpy()}
+
+
+def main(args):
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        weights = args.weights
+
+        if weights is None:
+            torch.manual_seed(0)
+            weights = f'{folder}/weights.pt'
+            torch.save(UNET(precision='float64').state_dict(), weights)
+
+        for precision, channels_last in configs:
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run_config, (args, precision, channels_last, weights)))
+
+    baseline = results[0]['preds']
+
+    print('{:<10}{:>15}{:>18}{:>17}{:>15}{:>15}'.format(
+        'precision', 'channels_last', 'inference, 1/s', 'training, 1/s', 'peak RSS, MB', 'max abs diff'))
+
+    for result in results:
+        result['max_abs_diff'] = float(np.abs(result.pop('preds') - baseline).max())
+        print('{:<10}{:>15}{:>18.1f}{:>17.1f}{:>15.0f}{:>15.2e}'.format(
+            result['precision'], str(result['channels_last']), result['inference'], result['training'],
+            result['peak_rss'], result['max_abs_diff']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+parser = ArgumentParser(description='Compare samples/s, peak memory, and predictions of the U-Net '
+                                    'across precisions against the float64 baseline')
+parser.add_argument('--store', default='store')
+parser.add_argument('--region', default='crop')
+parser.add_argument('--test-year', type=int, default=2021)
+parser.add_argument('--weights', help='model.pt or a state dict, randomly initialized weights by default')
+parser.add_argument('--batch-size', type=int, default=16)
+parser.add_argument('--threads', type=int, default=os.cpu_count())
+parser.add_argument('--synthetic', action='store_true', help='random inputs instead of the store')
+parser.add_argument('--samples', type=int, default=64)
+parser.add_argument('--size', type=int, default=96)
+parser.add_argument('--output')
+
+if __name__ == '__main__':
+    main(parser.parse_args())
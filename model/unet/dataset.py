@@ -0,0 +1,151 @@
+import os
+import json
+
+import numpy as np
+import xarray as xr
+
+import torch
+from torch.utils.data import Dataset
+
+
+def get_sample(ds, region='bur'):
+    """Convert one combined year into float32 (time, 2, y, x) inputs and (time, 1, y, x) fire masks"""
+
+    array = np.moveaxis(ds[['FWI', 'forest_cover', 'counts']].to_array().to_numpy(), 0, 1)
+
+    if region == 'bur':
+        array = np.concatenate([array, np.full((array.shape[0], 3, 73, 1), np.nan)], axis=3)[:, :, :72, :]
+    elif region == 'crop':
+        array = array[:, :, 2:-2, 2:-2]
+    else:
+        raise ValueError(
+            "Incorrect value passed in 'region' argument! Should be either 'bur' or 'crop'.")
+
+    valid = np.isfinite(array[:, 0]).any(axis=(1, 2))
+
+    data = preprocess(array[:, :2])
+    mask = np.where(array[:, 2:] > 0, 1, 0).astype(np.float32)
+
+    return data, mask, valid
+
+
+def preprocess(array):
+    """Model inputs from raw (..., 2, y, x) FWI and forest cover: NaN set to zero and the log of FWI"""
+
+    data = np.nan_to_num(array).astype(np.float32)
+    with np.errstate(divide='ignore'):
+        data[..., 0, :, :] = np.log(data[..., 0, :, :])
+
+    return data
+
+
+def build_store(years, region='bur', source=None, path='store'):
+    """Decode the combined '{source}/{year}.nc' files once into memory-mapped arrays under '{path}/{region}',
+    writing one year at a time so the store can be larger than RAM"""
+
+    source = source or region
+    folder = f'{path}/{region}'
+    os.makedirs(folder, exist_ok=True)
+
+    dates = []
+    for year in years:
+        with xr.open_dataset(f'{source}/{year}.nc') as ds:
+            dates.extend(str(date)[:10] for date in ds.time.values)
+
+    data_arr = mask_arr = None
+    valid = []
+    start = 0
+
+    for year in years:
+        with xr.open_dataset(f'{source}/{year}.nc') as ds:
+            data, mask, year_valid = get_sample(ds, region)
+
+            if data_arr is None:
+                y, x = get_coords(ds, region)
+                data_arr = np.lib.format.open_memmap(f'{folder}/data.npy.part', mode='w+', dtype=np.float32,
+                                                     shape=(len(dates), *data.shape[1:]))
+                mask_arr = np.lib.format.open_memmap(f'{folder}/mask.npy.part', mode='w+', dtype=np.float32,
+                                                     shape=(len(dates), *mask.shape[1:]))
+
+        data_arr[start:start + len(data)] = data
+        mask_arr[start:start + len(mask)] = mask
+        valid.extend(year_valid.tolist())
+        start += len(data)
+
+    data_arr.flush()
+    mask_arr.flush()
+    del data_arr, mask_arr
+
+    os.replace(f'{folder}/data.npy.part', f'{folder}/data.npy')
+    os.replace(f'{folder}/mask.npy.part', f'{folder}/mask.npy')
+
+    with open(f'{folder}/index.json', 'w') as f:
+        json.dump({'dates': dates, 'valid': valid, 'y': y, 'x': x}, f)
+
+    return folder
+
+
+def get_coords(ds, region='bur'):
+    y, x = ds.y.values, ds.x.values
+
+    if region == 'bur':
+        y, x = y[:72], np.append(x, 2 * x[-1] - x[-2])
+    elif region == 'crop':
+        y, x = y[2:-2], x[2:-2]
+
+    return y.tolist(), x.tolist()
+
+
+class GeoDataset(Dataset):
+    """Days of a store built by 'build_store', read as zero-copy views of the memory-mapped arrays.
+    The arrays are opened lazily, so each 'DataLoader' worker maps the files on its own. With 'valid_only'
+    the days without any FWI value are left out, 'time_indexes' then aligns the samples with the time
+    axis of the yearly files"""
+
+    def __init__(self, region='bur', years=range(2017, 2021), path='store', valid_only=False):
+        self.folder = f'{path}/{region}'
+
+        with open(f'{self.folder}/index.json') as f:
+            self.index = json.load(f)
+
+        years = set(years)
+        self.indexes = np.array([i for i, (date, valid) in enumerate(zip(self.index['dates'], self.index['valid']))
+                                 if int(date[:4]) in years and (valid or not valid_only)])
+
+        self.data = None
+        self.mask = None
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, idx):
+        if self.data is None:
+            self.open()
+
+        rows = self.indexes[idx]
+
+        return torch.from_numpy(self.data[rows]), torch.from_numpy(self.mask[rows])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = state['mask'] = None
+
+        return state
+
+    def open(self):
+        # copy-on-write keeps the views writable for torch without reading the file into memory
+        self.data = np.load(f'{self.folder}/data.npy', mmap_mode='c')
+        self.mask = np.load(f'{self.folder}/mask.npy', mmap_mode='c')
+
+    @property
+    def dates(self):
+        return [self.index['dates'][i] for i in self.indexes]
+
+    @property
+    def time_indexes(self):
+        """Position of every sample on the time axis of its year"""
+
+        years = np.array([int(date[:4]) for date in self.index['dates']])
+        starts = {year: np.argmax(years == year) for year in np.unique(years)}
+
+        return np.array([i - starts[years[i]] for i in self.indexes])
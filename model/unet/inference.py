@@ -0,0 +1,199 @@
+from collections import deque
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+
+import torch
+
+from unet import load_model, predict_batch
+from dataset import preprocess
+
+
+def prefetch(executor, func, items, size):
+    """Like 'executor.map' but with at most 'size' items submitted ahead of the consumer"""
+
+    futures = deque()
+
+    for item in items:
+        futures.append(executor.submit(func, item))
+
+        if len(futures) >= size:
+            yield futures.popleft().result()
+
+    while futures:
+        yield futures.popleft().result()
+
+
+class TiledPredictor:
+    """Fire probability maps of grids of any size, predicted in overlapping tiles.
+
+    Every day is split into 'tile' x 'tile' windows overlapping by 'overlap' pixels, the grid is zero padded so
+    the windows cover it. Tiles of consecutive days are batched together, and the predictions of overlapping
+    tiles are blended with weights falling linearly towards the tile edges. Days are read and tiled by 'workers'
+    threads while the model runs, and only the days with tiles in flight are held in memory"""
+
+    def __init__(self, model, tile=96, overlap=16, batch_size=32, workers=2):
+        if tile % 16:
+            raise ValueError(
+                f"'tile' should be a multiple of 16 for the four poolings of the U-Net, got {tile}!")
+        if not 0 <= overlap < tile:
+            raise ValueError(
+                f"'overlap' should be between 0 and 'tile', got {overlap}!")
+
+        self.model = model
+        self.tile = tile
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.workers = workers
+
+        self.window = self.get_window()
+
+    def get_window(self):
+        ramp = np.minimum(np.arange(1, self.tile + 1), np.arange(self.tile, 0, -1))
+        ramp = np.minimum(ramp / max(self.overlap, 1), 1)
+
+        return np.outer(ramp, ramp).astype(np.float32)
+
+    def get_starts(self, size):
+        """Offsets of the tiles along one side and the padded length they cover"""
+
+        step = self.tile - self.overlap
+        n_tiles = max(int(np.ceil((size - self.tile) / step)), 0) + 1
+
+        return [i * step for i in range(n_tiles)], (n_tiles - 1) * step + self.tile
+
+    def get_inputs(self, ds, i):
+        """Read and preprocess one day, padded to the extent of the tiles"""
+
+        fwi = ds.FWI.isel(time=i).transpose('y', 'x').to_numpy()
+        forest = ds.forest_cover
+
+        if 'time' in forest.dims:
+            forest = forest.isel(time=i)
+
+        data = preprocess(np.stack([fwi, forest.transpose('y', 'x').to_numpy()]))
+        # pixels outside the clipped region have no FWI, log(0) would spread to the whole tile
+        data[~np.isfinite(data)] = 0
+
+        (_, height), (_, width) = self.get_starts(fwi.shape[0]), self.get_starts(fwi.shape[1])
+        data = np.pad(data, [(0, 0), (0, height - fwi.shape[0]), (0, width - fwi.shape[1])])
+
+        return data, np.isnan(fwi)
+
+    def predict(self, ds):
+        """Yield the time and the (y, x) probability map of every day of 'ds', in order"""
+
+        y_starts, height = self.get_starts(ds.sizes['y'])
+        x_starts, width = self.get_starts(ds.sizes['x'])
+        tiles = [(y, x) for y in y_starts for x in x_starts]
+
+        pending = deque()
+        batch = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            days = prefetch(executor, lambda i: self.get_inputs(ds, i), range(ds.sizes['time']), 2 * self.workers)
+
+            for i, (data, missing) in enumerate(days):
+                day = {'time': ds.time.values[i],
+                       'missing': missing,
+                       'sum': np.zeros((height, width), dtype=np.float32),
+                       'weight': np.zeros((height, width), dtype=np.float32),
+                       'left': len(tiles)}
+                pending.append(day)
+
+                for y, x in tiles:
+                    batch.append((day, y, x, data[:, y:y + self.tile, x:x + self.tile]))
+
+                    if len(batch) == self.batch_size:
+                        self.run_batch(batch)
+                        batch = []
+
+                yield from self.get_finished(pending)
+
+            if batch:
+                self.run_batch(batch)
+
+            yield from self.get_finished(pending)
+
+    def run_batch(self, batch):
+        inputs = torch.from_numpy(np.stack([tile for *_, tile in batch]))
+        preds = predict_batch(self.model, inputs)[:, 0].numpy()
+
+        for (day, y, x, _), pred in zip(batch, preds):
+            day['sum'][y:y + self.tile, x:x + self.tile] += pred * self.window
+            day['weight'][y:y + self.tile, x:x + self.tile] += self.window
+            day['left'] -= 1
+
+    @staticmethod
+    def get_finished(pending):
+        while pending and pending[0]['left'] == 0:
+            day = pending.popleft()
+            height, width = day['missing'].shape
+
+            prob = day['sum'][:height, :width] / day['weight'][:height, :width]
+            prob[day['missing']] = np.nan
+
+            yield day['time'], prob
+
+    def predict_ds(self, ds):
+        """Yield the probability map of every day as a DataArray on the grid of 'ds'"""
+
+        for time, prob in self.predict(ds):
+            yield xr.DataArray(prob[np.newaxis], name='prob',
+                               coords={'time': [time], 'y': ds.y, 'x': ds.x}, dims=['time', 'y', 'x'])
+
+    def to_netcdf(self, ds, path):
+        """Write the probability maps to 'path' one day at a time along an unlimited time dimension"""
+
+        height, width = ds.sizes['y'], ds.sizes['x']
+
+        with netCDF4.Dataset(path, 'w') as nc:
+            nc.createDimension('time', None)
+            nc.createDimension('y', height)
+            nc.createDimension('x', width)
+
+            nc_time = nc.createVariable('time', 'i4', ('time',))
+            nc_time.units = 'days since 1970-01-01'
+            nc_time.calendar = 'standard'
+
+            for dim in ['y', 'x']:
+                var = nc.createVariable(dim, ds[dim].dtype, (dim,))
+                var.setncatts(ds[dim].attrs)
+                var[:] = ds[dim].to_numpy()
+
+            prob = nc.createVariable('prob', 'f4', ('time', 'y', 'x'), zlib=True, complevel=4,
+                                     chunksizes=(1, min(height, 256), min(width, 256)), fill_value=np.nan)
+
+            if 'spatial_ref' in ds.coords:
+                crs = nc.createVariable('spatial_ref', 'i4')
+                crs.setncatts(ds.spatial_ref.attrs)
+                prob.grid_mapping = 'spatial_ref'
+
+            for i, (time, day) in enumerate(self.predict(ds)):
+                nc_time[i] = netCDF4.date2num(pd.Timestamp(time).to_pydatetime(), nc_time.units, nc_time.calendar)
+                prob[i] = day
+
+
+parser = ArgumentParser(description='Predict daily fire probability maps of a combined dataset in tiles')
+parser.add_argument('source', help="combined '{year}.nc' file of any region")
+parser.add_argument('weights', help='model.pt or a state dict')
+parser.add_argument('output')
+parser.add_argument('--precision', default='float32', choices=['float64', 'float32', 'bfloat16'])
+parser.add_argument('--tile', type=int, default=96)
+parser.add_argument('--overlap', type=int, default=16)
+parser.add_argument('--batch-size', type=int, default=32)
+parser.add_argument('--workers', type=int, default=2)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    model = load_model(args.weights, precision=args.precision, channels_last=True)
+    predictor = TiledPredictor(model, tile=args.tile, overlap=args.overlap, batch_size=args.batch_size,
+                               workers=args.workers)
+
+    with xr.open_dataset(args.source) as ds:
+        predictor.to_netcdf(ds, args.output)
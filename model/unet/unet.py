@@ -0,0 +1,247 @@
+from contextlib import nullcontext
+from collections import OrderedDict
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+
+from tqdm import tqdm
+
+
+precisions = {'float64': torch.double, 'float32': torch.float32, 'bfloat16': torch.float32}
+
+
+class UNET(nn.Module):
+    """U-Net over (batch, channels, y, x) grids with sides divisible by 16.
+
+    'precision' is the dtype of the weights and inputs: 'float64', 'float32' or 'bfloat16', where 'bfloat16' keeps
+    float32 weights and runs the forward pass under bfloat16 autocast. 'channels_last' stores weights and inputs
+    in the NHWC layout, which is faster for convolutions on most CPUs"""
+
+    def __init__(self, in_channels=2, out_channels=1, n_features=16, precision='float32', channels_last=False):
+        super().__init__()
+
+        if precision not in precisions:
+            raise ValueError(
+                "Incorrect value passed in 'precision' argument! Should be either 'float64', 'float32', or 'bfloat16'.")
+
+        features = n_features
+        self.precision = precision
+        self.channels_last = channels_last
+
+        self.encoder1 = UNET.conv_block(in_channels, features, name='enc1')
+        self.pool1 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        self.encoder2 = UNET.conv_block(features, features*2, name='enc2')
+        self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        self.encoder3 = UNET.conv_block(features*2, features*4, name='enc3')
+        self.pool3 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        self.encoder4 = UNET.conv_block(features*4, features*8, name='enc4')
+        self.pool4 = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        self.bottleneck = UNET.conv_block(features*8, features*16,
+                                          name='bottleneck')
+
+        self.upconv4 = nn.ConvTranspose2d(features*16, features*8,
+                                          kernel_size=2, stride=2)
+        self.decoder4 = UNET.conv_block(features*16, features*8, name='dec3')
+
+        self.upconv3 = nn.ConvTranspose2d(features*8, features*4,
+                                          kernel_size=2, stride=2)
+        self.decoder3 = UNET.conv_block(features*8, features*4, name='dec3')
+
+        self.upconv2 = nn.ConvTranspose2d(features*4, features*2,
+                                          kernel_size=2, stride=2)
+        self.decoder2 = UNET.conv_block(features*4, features*2, name='dec2')
+
+        self.upconv1 = nn.ConvTranspose2d(features*2, features,
+                                          kernel_size=2, stride=2)
+        self.decoder1 = UNET.conv_block(features*2, features, name='dec1')
+
+        self.conv = nn.Conv2d(in_channels=features,
+                              out_channels=out_channels,
+                              kernel_size=1)
+
+        self.to(dtype=self.dtype)
+
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    @property
+    def dtype(self):
+        return precisions[self.precision]
+
+    def forward(self, x):
+        enc1 = self.encoder1(x)
+        enc2 = self.encoder2(self.pool1(enc1))
+        enc3 = self.encoder3(self.pool2(enc2))
+        enc4 = self.encoder4(self.pool3(enc3))
+
+        bottleneck = self.bottleneck(self.pool4(enc4))
+
+        dec4 = self.upconv4(bottleneck)
+        dec4 = torch.cat((dec4, enc4), dim=1)
+        dec4 = self.decoder4(dec4)
+
+        dec3 = self.upconv3(dec4)
+        dec3 = torch.cat((dec3, enc3), dim=1)
+        dec3 = self.decoder3(dec3)
+
+        dec2 = self.upconv2(dec3)
+        dec2 = torch.cat((dec2, enc2), dim=1)
+        dec2 = self.decoder2(dec2)
+
+        dec1 = self.upconv1(dec2)
+        dec1 = torch.cat((dec1, enc1), dim=1)
+        dec1 = self.decoder1(dec1)
+
+        return torch.sigmoid(self.conv(dec1))
+
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+    def prepare(self, batch, device=None):
+        """Move a batch to 'device', the device of the model by default, with the dtype and memory layout
+        of the model"""
+
+        device = device or self.device
+        batch = batch.to(device, dtype=self.dtype)
+
+        if self.channels_last and batch.dim() == 4:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+
+        return batch
+
+    def autocast(self):
+        if self.precision != 'bfloat16':
+            return nullcontext()
+
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+
+    @staticmethod
+    def conv_block(in_channels, features, name):
+        return nn.Sequential(
+            OrderedDict(
+                [
+                    (
+                        name + "conv1",
+                        nn.Conv2d(
+                            in_channels=in_channels,
+                            out_channels=features,
+                            kernel_size=3,
+                            padding=1,
+                            bias=False,
+                        ),
+                    ),
+                    (name + "norm1", nn.BatchNorm2d(num_features=features)),
+                    (name + "relu1", nn.ReLU(inplace=True)),
+                    (
+                        name + "conv2",
+                        nn.Conv2d(
+                            in_channels=features,
+                            out_channels=features,
+                            kernel_size=3,
+                            padding=1,
+                            bias=False,
+                        ),
+                    ),
+                    (name + "norm2", nn.BatchNorm2d(num_features=features)),
+                    (name + "relu2", nn.ReLU(inplace=True)),
+                ]
+            )
+        )
+
+
+def load_model(path, precision='float32', channels_last=False, device='cpu', **kwargs):
+    """Load weights saved either as a whole model or as a state dict into a model of the given precision,
+    so a model trained in float64 can run in float32 or bfloat16"""
+
+    saved = torch.load(path, map_location=device, weights_only=False)
+    state_dict = saved.state_dict() if isinstance(saved, nn.Module) else saved
+
+    model = UNET(precision=precision, channels_last=channels_last, **kwargs)
+    model.load_state_dict(state_dict)
+
+    return model.to(device).eval()
+
+
+def fit_epoch(model, train_loader, criterion, optimizer, device=None):
+    model.train()
+    running_loss = []
+
+    for data, mask in train_loader:
+        data = model.prepare(data, device)
+        mask = mask.to(data.device, dtype=model.dtype)
+
+        with model.autocast():
+            pred = model(data)
+        loss = criterion(pred.to(mask.dtype), mask)
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        running_loss.append(loss.item())
+
+    return np.array(running_loss).mean()
+
+
+def eval_epoch(model, val_loader, criterion, device=None):
+    model.eval()
+    running_loss = []
+
+    for data, mask in val_loader:
+        data = model.prepare(data, device)
+        mask = mask.to(data.device, dtype=model.dtype)
+
+        with torch.inference_mode(), model.autocast():
+            pred = model(data)
+            loss = criterion(pred.to(mask.dtype), mask)
+
+            running_loss.append(loss.item())
+
+    return np.array(running_loss).mean()
+
+
+def train(model, train_loader, val_loader, epochs, criterion, optimizer, save_best=None, device=None):
+    history = []
+    best_val_loss = 1000
+    log_template = '\nEpoch {ep:03d} train_loss: {t_loss:0.4f} val_loss {v_loss:0.4f}'
+
+    with tqdm(desc='epoch', total=epochs) as pbar_outer:
+        for epoch in range(epochs):
+            train_loss = fit_epoch(model, train_loader, criterion, optimizer, device)
+
+            val_loss = eval_epoch(model, val_loader, criterion, device)
+            history.append((train_loss, val_loss))
+
+            if save_best:
+                if val_loss < best_val_loss:
+                    best_val_loss = val_loss
+                    torch.save(model.state_dict(), save_best)
+
+            pbar_outer.update(1)
+            tqdm.write(log_template.format(ep=epoch+1, t_loss=train_loss, v_loss=val_loss))
+            print('')
+
+    if save_best:
+        model.load_state_dict(torch.load(save_best, map_location=model.device))
+
+    return history
+
+
+def predict_batch(model, batch, device=None):
+    model.eval()
+
+    with torch.inference_mode(), model.autocast():
+        pred = model(model.prepare(batch, device))
+
+    return pred.float().cpu()
+
+
+def predict_one_sample(model, inputs, device=None):
+    return predict_batch(model, inputs.unsqueeze(0), device)[0]